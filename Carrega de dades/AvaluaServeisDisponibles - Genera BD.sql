@@ -49,6 +49,56 @@ CREATE INDEX sto_serv_disp_temps_int_idx ON atm.sto_serv_disp USING btree (temps
 
 
 
+-- atm.sto_puntuades definition
+-- Serveis connectats per parada i dia (AvaluaServeisDisponibles.creaParadesPuntuades)
+
+-- Drop table
+
+-- DROP TABLE atm.sto_puntuades;
+
+CREATE TABLE atm.sto_puntuades (
+	id int4 GENERATED BY DEFAULT AS IDENTITY NOT NULL,
+	stop_id text NULL,
+	dia date NULL,
+	dia_timestamp timestamp NULL,
+	lst_serv_arribada_dia int4[] NULL,
+	lst_serv_sortida_dia int4[] NULL,
+	lst_serv_arribada_setmana int4[] NULL,
+	lst_serv_sortida_setmana int4[] NULL,
+	num_serv_arribada_dia int4 NULL,
+	num_serv_sortida_dia int4 NULL,
+	num_serv_arribada_setmana int4 NULL,
+	num_serv_sortida_setmana int4 NULL,
+	geom public.geometry(point, 25831) NULL
+);
+CREATE INDEX sto_puntuades_dia_idx ON atm.sto_puntuades USING btree (dia);
+CREATE INDEX sto_puntuades_stop_id_idx ON atm.sto_puntuades USING btree (stop_id);
+
+-- atm.sto_puntuades_dia definition
+-- Agregats diaris per parada a partir dels quals creaParadesPuntuades calcula
+-- les xifres del dia i, amb una suma mòbil de 7 dies, les de la setmana.
+
+-- Drop table
+
+-- DROP TABLE atm.sto_puntuades_dia;
+
+CREATE TABLE atm.sto_puntuades_dia (
+	stop_id text NOT NULL,
+	dia date NOT NULL,
+	num_passos int4 NULL,
+	num_serv_arribada int4 NULL,
+	num_serv_sortida int4 NULL,
+	lst_serv_arribada int4[] NULL,
+	lst_serv_sortida int4[] NULL,
+	CONSTRAINT sto_puntuades_dia_pkey PRIMARY KEY (dia, stop_id)
+);
+
+-- Concatena arrays (llistes de serveis connectats) dins d'un GROUP BY. PostgreSQL 14+
+CREATE AGGREGATE atm.array_cat_agg(anycompatiblearray) (
+	SFUNC = array_cat,
+	STYPE = anycompatiblearray
+);
+
 
 -- SQL DE TEST
 select subq.lst_arribada, subq.lst_sortida, subq.stop_id
@@ -1,9 +1,15 @@
 import psycopg2
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from psycopg2.pool import ThreadedConnectionPool
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta, timezone
-from typing import List, Optional, Any
+from typing import List, Optional, Any, Tuple
+import argparse
 import ast
+import io
 import time  # nou
+import numpy as np
+import pandas as pd
 
 def crea_conn_postgis(
     host: str = "localhost",
@@ -54,19 +60,29 @@ def actualitzaConnexions(
     resultats: List[Optional[Any]] = []
 
     try:            
+        # Taula temporal de la sessió (no compartida amb altres execucions), només
+        # amb les columnes i l'índex que fan servir les finestres
+        cur.execute("""CREATE TEMP TABLE serveis_finestra (
+                            id int4,
+                            stop_id text,
+                            temps_int int4
+                        )""")
+        cur.execute("CREATE INDEX ON serveis_finestra (stop_id, temps_int)")
+
         start = time.perf_counter()  # iniciem mesura
         i=0
         total = len(timestamps)
         for idx,ts in enumerate(timestamps, start=1):
             
-            sql = """delete from serveis_projectats_tmp"""
-            cur.execute(sql)
+            cur.execute("TRUNCATE serveis_finestra")
 
-            sql = """insert into serveis_projectats_tmp 
-                        select * from serveis_projectats sp \
-                        where sp.temps_int >= %s
-                            AND sp.temps_int < %s+(60*60)"""
-            cur.execute(sql, (ts, ts))
+            # L'hora més temps_espera a cada costat, per les connexions dels passos propers als límits
+            sql = """insert into serveis_finestra 
+                        select sp.id, sp.stop_id, sp.temps_int from serveis_projectats sp \
+                        where sp.temps_int >= %s-(60*%s)
+                            AND sp.temps_int < %s+(60*60)+(60*%s)"""
+            cur.execute(sql, (ts, temps_espera, ts, temps_espera))
+            cur.execute("ANALYZE serveis_finestra")
         
             sql="UPDATE serveis_projectats sp\
                     SET lst_serv_arribada = null,\
@@ -76,31 +92,44 @@ def actualitzaConnexions(
                     WHERE sp.temps_int >= %s and sp.temps_int < %s+(60*60);"
             cur.execute(sql, (ts, ts))
 
+            # Arribades i sortides s'agreguen per separat: amb dos LEFT JOIN a la mateixa
+            # consulta cada arribada es repetiria per cada sortida (producte creuat)
             sql="UPDATE serveis_projectats sp\
-                SET lst_serv_arribada = subq.lst_arribada,\
-                    lst_serv_sortida = subq.lst_sortida,\
-                    num_serv_arribada = subq.num_lst_arribada,\
-                    num_serv_sortida = subq.num_lst_sortida\
+                SET lst_serv_arribada = arr.lst,\
+                    lst_serv_sortida = sort.lst,\
+                    num_serv_arribada = coalesce(arr.num, 0),\
+                    num_serv_sortida = coalesce(sort.num, 0)\
                 FROM (\
                     SELECT sp_main.id as sp_id,\
-                        string_agg(spp_arr.id::text,',') FILTER (WHERE spp_arr.id IS NOT NULL) as lst_arribada,\
-                        string_agg(spp_sort.id::text,',') FILTER (WHERE spp_sort.id IS NOT NULL) as lst_sortida,\
-                        count(spp_arr.id) FILTER (WHERE spp_arr.id IS NOT NULL) as num_lst_arribada,\
-                        count(spp_sort.id) FILTER (WHERE spp_sort.id IS NOT NULL) as num_lst_sortida\
-                    FROM serveis_projectats_tmp sp_main\
-                    INNER JOIN sto_properes pp ON pp.stop_id = sp_main.stop_id\
-                    LEFT JOIN serveis_projectats_tmp spp_arr ON pp.stop_id_propera = spp_arr.stop_id\
-                        AND spp_arr.temps_int >= sp_main.temps_int - (60*%s)\
-                        AND spp_arr.temps_int <= sp_main.temps_int\
-                    LEFT JOIN serveis_projectats_tmp spp_sort ON pp.stop_id_propera = spp_sort.stop_id\
-                        AND spp_sort.temps_int >= sp_main.temps_int\
-                        AND spp_sort.temps_int <= sp_main.temps_int + (60*%s)\
-                    WHERE sp_main.temps_int >= %s \
-                    AND sp_main.temps_int < %s + (60*60) \
+                        array_agg(spp.id) as lst,\
+                        count(*) as num\
+                    FROM serveis_finestra sp_main\
+                    INNER JOIN (SELECT DISTINCT stop_id, stop_id_propera FROM sto_properes) pp\
+                        ON pp.stop_id = sp_main.stop_id\
+                    INNER JOIN serveis_finestra spp ON pp.stop_id_propera = spp.stop_id\
+                        AND spp.temps_int >= sp_main.temps_int - (60*%(espera)s)\
+                        AND spp.temps_int <= sp_main.temps_int\
+                    WHERE sp_main.temps_int >= %(ts)s \
+                    AND sp_main.temps_int < %(ts)s + (60*60) \
+                    GROUP BY sp_main.id\
+                ) arr\
+                FULL JOIN (\
+                    SELECT sp_main.id as sp_id,\
+                        array_agg(spp.id) as lst,\
+                        count(*) as num\
+                    FROM serveis_finestra sp_main\
+                    INNER JOIN (SELECT DISTINCT stop_id, stop_id_propera FROM sto_properes) pp\
+                        ON pp.stop_id = sp_main.stop_id\
+                    INNER JOIN serveis_finestra spp ON pp.stop_id_propera = spp.stop_id\
+                        AND spp.temps_int >= sp_main.temps_int\
+                        AND spp.temps_int <= sp_main.temps_int + (60*%(espera)s)\
+                    WHERE sp_main.temps_int >= %(ts)s \
+                    AND sp_main.temps_int < %(ts)s + (60*60) \
                     GROUP BY sp_main.id\
-                ) subq\
-                WHERE sp.id = subq.sp_id;"
-            cur.execute(sql, (temps_espera, temps_espera, ts, ts))
+                ) sort ON sort.sp_id = arr.sp_id\
+                WHERE sp.id = coalesce(arr.sp_id, sort.sp_id)\
+                AND sp.temps_int >= %(ts)s AND sp.temps_int < %(ts)s + (60*60);"
+            cur.execute(sql, {'espera': temps_espera, 'ts': ts})
             # nombre de registres actualitzats per aquesta execució
             row = (cur.rowcount,)
             x = row[0]
@@ -131,116 +160,452 @@ def actualitzaConnexions(
 
     return resultats
 
-def creaParadesPuntuades(
+def llistes_finestres(
+        propietari: np.ndarray,
+        inici: np.ndarray,
+        fi: np.ndarray,
+        ids: np.ndarray,
+        num_propietaris: int
+    ) -> tuple:
+    """
+    Expandeix les finestres [inici, fi) sobre `ids` i les agrupa per propietari.
+
+    Retorna (llistes, recomptes): per cada propietari 0..num_propietaris-1, els ids
+    en format literal d'array int4[] de PostgreSQL ('{1,2,3}', None si no n'hi ha
+    cap) i el nombre d'ids.
+    """
+    longituds = fi - inici
+    recomptes = np.bincount(propietari, weights=longituds, minlength=num_propietaris).astype(np.int64)
+    total = int(longituds.sum())
+    llistes = np.full(num_propietaris, None, dtype=object)
+    if total == 0:
+        return llistes, recomptes
+
+    # Posicions de tots els elements de totes les finestres, sense bucle Python
+    desplacament = np.repeat(np.cumsum(longituds) - longituds, longituds)
+    posicions = np.repeat(inici, longituds) + (np.arange(total) - desplacament)
+    propietaris = np.repeat(propietari, longituds)
+
+    agrupats = pd.Series(ids[posicions].astype(str)).groupby(propietaris).agg(','.join)
+    llistes[agrupats.index.to_numpy()] = ('{' + agrupats + '}').to_numpy()
+    return llistes, recomptes
+
+
+def actualitzaConnexionsFinestra(
         data_inicial: str,
+        temps_espera: int,
+        num_hores: int,
+        *,
+        host: str = "192.168.1.251",
+        port: int = 5432,
+        dbname: str = "gisdb",
+        user: str = "atm",
+        password: str = "atm",
+        tz: timezone = timezone.utc,
+        informa: bool = True
+    ) -> int:
+    """
+    Alternativa a actualitzaConnexions que calcula les connexions de tot el període
+    [data_inicial, data_inicial + num_hores) d'una sola passada.
+
+    Carrega una vegada els passos del període (més `temps_espera` minuts a cada
+    costat, perquè els passos propers als límits tinguin totes les connexions) i
+    sto_properes. Amb els passos ordenats per (parada, temps_int), les finestres
+    d'arribada [t - espera, t] i de sortida [t, t + espera] de cada pas a cada
+    parada propera són rangs contigus que es localitzen amb cerca binària.
+
+    El resultat s'escriu a serveis_projectats amb COPY a una taula temporal i un
+    sol UPDATE, en una transacció. Amb informa=False no s'escriu el progrés
+    (actualitzaConnexionsPerDies el resumeix per a tots els dies).
+
+    Returns:
+        int: Nombre de passos actualitzats
+    """
+    dt0 = datetime.strptime(data_inicial, "%Y/%m/%d").replace(tzinfo=tz)
+    t_inici = int(dt0.timestamp())
+    t_fi = int((dt0 + timedelta(hours=num_hores)).timestamp())
+    espera = 60 * temps_espera
+    base = t_inici - espera  # temps_int mínim carregat
+
+    conn = crea_conn_postgis(host, port, dbname, user, password)
+    conn.autocommit = False
+    cur = conn.cursor()
+
+    try:
+        start = time.perf_counter()
+        if informa:
+            print("Carregant passos i parades properes...")
+        passos = pd.read_sql_query(
+            "SELECT id, stop_id::text AS stop_id, temps_int FROM serveis_projectats"
+            " WHERE temps_int >= %s AND temps_int < %s AND stop_id IS NOT NULL",
+            conn, params=(base, t_fi + espera))
+        properes = pd.read_sql_query(
+            "SELECT DISTINCT stop_id::text AS stop_id, stop_id_propera::text AS stop_id_propera"
+            " FROM sto_properes", conn)
+
+        # Passos ordenats per (parada, temps_int) i clau combinada per a la cerca binària
+        parades = pd.Index(passos['stop_id'].unique())
+        codi = parades.get_indexer(passos['stop_id'])
+        temps = passos['temps_int'].to_numpy(dtype=np.int64)
+        ordre = np.lexsort((temps, codi))
+        claus = (codi[ordre].astype(np.int64) << 32) | (temps[ordre] - base)
+        ids = passos['id'].to_numpy()[ordre]
+
+        # Passos a actualitzar i les seves parades properes amb passos
+        objectiu = np.flatnonzero((temps >= t_inici) & (temps < t_fi))
+        if informa:
+            print(f"Carregats {len(passos)} passos ({len(objectiu)} a actualitzar) "
+                  f"({timedelta(seconds=time.perf_counter() - start)})")
+
+        properes['codi'] = parades.get_indexer(properes['stop_id'])
+        properes['codi_propera'] = parades.get_indexer(properes['stop_id_propera'])
+        properes = properes[(properes['codi'] >= 0) & (properes['codi_propera'] >= 0)]
+        parelles = pd.DataFrame({'pas': np.arange(len(objectiu)), 'codi': codi[objectiu]}).merge(
+            properes[['codi', 'codi_propera']], on='codi')
+
+        pas = parelles['pas'].to_numpy()
+        propera = parelles['codi_propera'].to_numpy(dtype=np.int64) << 32
+        t_pas = temps[objectiu][pas] - base
+        arr_inici = np.searchsorted(claus, propera | (t_pas - espera), side='left')
+        arr_fi = np.searchsorted(claus, propera | t_pas, side='right')
+        sort_inici = np.searchsorted(claus, propera | t_pas, side='left')
+        sort_fi = np.searchsorted(claus, propera | (t_pas + espera), side='right')
+
+        lst_arribada, num_arribada = llistes_finestres(pas, arr_inici, arr_fi, ids, len(objectiu))
+        lst_sortida, num_sortida = llistes_finestres(pas, sort_inici, sort_fi, ids, len(objectiu))
+        if informa:
+            print(f"Connexions calculades ({timedelta(seconds=time.perf_counter() - start)})")
+
+        resultat = pd.DataFrame({
+            'id': passos['id'].to_numpy()[objectiu],
+            'lst_serv_arribada': lst_arribada,
+            'lst_serv_sortida': lst_sortida,
+            'num_serv_arribada': num_arribada,
+            'num_serv_sortida': num_sortida,
+        })
+        buffer = io.StringIO()
+        resultat.to_csv(buffer, header=False, index=False)
+        buffer.seek(0)
+
+        cur.execute("""CREATE TEMP TABLE connexions_finestra (
+                            id int4,
+                            lst_serv_arribada int4[],
+                            lst_serv_sortida int4[],
+                            num_serv_arribada int4,
+                            num_serv_sortida int4
+                        ) ON COMMIT DROP""")
+        cur.copy_expert("COPY connexions_finestra FROM STDIN WITH (FORMAT csv)", buffer)
+        cur.execute("""UPDATE serveis_projectats sp
+                        SET lst_serv_arribada = c.lst_serv_arribada,
+                            lst_serv_sortida = c.lst_serv_sortida,
+                            num_serv_arribada = c.num_serv_arribada,
+                            num_serv_sortida = c.num_serv_sortida
+                        FROM connexions_finestra c
+                        WHERE sp.id = c.id
+                            AND sp.temps_int >= %s AND sp.temps_int < %s""", (t_inici, t_fi))
+        actualitzats = cur.rowcount
+        conn.commit()
+
+        elapsed = time.perf_counter() - start
+        if informa:
+            print(f"Passos actualitzats: {actualitzats}")
+            print(f"Temps total de procés: {timedelta(seconds=elapsed)}")
+        return actualitzats
+
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+def actualitzaConnexionsPerDies(
+        data_inicial: str,
+        temps_espera: int,
         num_dies: int,
+        workers: int = 4,
+        *,
         host: str = "192.168.1.251",
         port: int = 5432,
         dbname: str = "gisdb",
         user: str = "atm",
         password: str = "atm",
         tz: timezone = timezone.utc
+    ) -> int:
+    """
+    Calcula les connexions de num_dies dies a partir de data_inicial repartint
+    els dies entre `workers` fils. Cada dia és independent: s'executa amb
+    actualitzaConnexionsFinestra, amb la seva connexió i la seva transacció.
+
+    Returns:
+        int: Nombre total de passos actualitzats
+    """
+    dt0 = datetime.strptime(data_inicial, "%Y/%m/%d").replace(tzinfo=tz)
+    dies = [(dt0 + timedelta(days=i)).strftime("%Y/%m/%d") for i in range(num_dies)]
+    total = len(dies)
+    actualitzats = 0
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(actualitzaConnexionsFinestra, dia, temps_espera, 24,
+                            host=host, port=port, dbname=dbname, user=user,
+                            password=password, tz=tz, informa=False): dia
+            for dia in dies
+        }
+        for idx, future in enumerate(as_completed(futures), start=1):
+            files = future.result()
+            actualitzats += files
+
+            # Càlcul d'ETA i velocitat agregada de tots els fils
+            elapsed = time.perf_counter() - start
+            eta_secs = int(elapsed / idx * (total - idx))
+            print(f"[{idx}/{total}] {futures[future]} --> passos actualitzats: {files} "
+                  f"({actualitzats / elapsed:.0f} files/s, {workers} fils) "
+                  f"(ETA: {timedelta(seconds=eta_secs)})")
+
+    elapsed = time.perf_counter() - start
+    print(f"Passos actualitzats: {actualitzats} ({actualitzats / elapsed:.0f} files/s)")
+    print(f"Temps total de procés: {timedelta(seconds=elapsed)}")
+    return actualitzats
+
+def agregaParadesDia(
+        conn: psycopg2.extensions.connection,
+        ts: int,
+        tz: timezone = timezone.utc,
+        amb_llistes: bool = True,
+        reutilitza: bool = False
+    ) -> Optional[Tuple[int, int]]:
+    """
+    Calcula i confirma els agregats per parada (sto_puntuades_dia) del dia que
+    comença a `ts`, llegint-lo de serveis_projectats.
+
+    Returns:
+        (parades, passos) del dia, o None si reutilitza=True i ja hi eren
+    """
+    dia = datetime.fromtimestamp(ts, tz).date()
+    # Les llistes són opcionals: els recomptes es calculen sumant enters
+    if amb_llistes:
+        llista = "atm.array_cat_agg(sp.{col}) FILTER (WHERE sp.{col} IS NOT NULL)"
+    else:
+        llista = "NULL::int4[]"
+
+    cur = conn.cursor()
+    try:
+        if reutilitza:
+            # Un dia calculat sense llistes no es reutilitza si ara se'n demanen
+            cur.execute("SELECT count(*) > 0,"
+                        " coalesce(bool_and(lst_serv_arribada IS NOT NULL OR coalesce(num_serv_arribada, 0) = 0), true)"
+                        " FROM atm.sto_puntuades_dia WHERE dia = %s", (dia,))
+            calculat, te_llistes = cur.fetchone()
+            if calculat and (te_llistes or not amb_llistes):
+                conn.commit()
+                return None
+
+        cur.execute("DELETE FROM atm.sto_puntuades_dia WHERE dia = %s", (dia,))
+        sql = """WITH agregats AS (
+                    INSERT INTO atm.sto_puntuades_dia (
+                        stop_id,
+                        dia,
+                        num_passos,
+                        num_serv_arribada,
+                        num_serv_sortida,
+                        lst_serv_arribada,
+                        lst_serv_sortida)
+                    SELECT
+                        sp.stop_id,
+                        %(dia)s,
+                        count(*),
+                        sum(sp.num_serv_arribada),
+                        sum(sp.num_serv_sortida),
+                        {arribada},
+                        {sortida}
+                    FROM atm.serveis_projectats sp
+                    WHERE sp.temps_int >= %(ts)s
+                    AND sp.temps_int < %(ts)s+(60*60*24)
+                    AND sp.stop_id IS NOT NULL
+                    GROUP BY sp.stop_id
+                    RETURNING num_passos
+                )
+                SELECT count(*), coalesce(sum(num_passos), 0) FROM agregats;
+            """.format(arribada=llista.format(col='lst_serv_arribada'),
+                       sortida=llista.format(col='lst_serv_sortida'))
+        cur.execute(sql, {'dia': dia, 'ts': ts})
+        parades, passos = cur.fetchone()
+        conn.commit()
+        return parades, int(passos)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+def creaParadesPuntuades(
+        data_inicial: str,
+        num_dies: int,
+        host: str = "192.168.1.251",
+        port: int = 5432,
+        dbname: str = "gisdb",
+        user: str = "atm",
+        password: str = "atm",
+        tz: timezone = timezone.utc,
+        amb_llistes: bool = True,
+        reutilitza: bool = False,
+        workers: int = 1
     ) -> List[Optional[Any]]:
     """
-    Executa l'UPDATE de lst_serv_arribada i lst_serv_sortida amb string_agg
-    per cada hora dels dies indicats per data_inicial i data_inicial+num_hores.
+    Omple sto_puntuades per cada dia a partir de data_inicial sumant els
+    recomptes num_serv_arribada i num_serv_sortida de serveis_projectats.
+
+    Primer es calculen els agregats diaris per parada (sto_puntuades_dia) dels
+    num_dies + 6 dies necessaris, llegint cada dia de serveis_projectats una
+    sola vegada. Les xifres de la setmana (el dia i els 6 següents) són una suma
+    mòbil d'aquests agregats diaris. Els agregats de cada dia són independents
+    i es reparteixen entre `workers` fils, amb una connexió per fil.
+
+    Per defecte (amb_llistes=True) també es desen les llistes (int4[]) dels
+    serveis connectats, concatenant les de cada pas; les necessiten temp.sql i
+    update_agencies.sql. Amb amb_llistes=False només es desen els recomptes.
+    Amb reutilitza=True no es tornen a calcular els dies que ja són a
+    sto_puntuades_dia, tret que s'hi demanin llistes i s'hagin calculat sense.
+
+    Returns:
+        List: Nombre de parades puntuades per cada dia
     """
     conn = crea_conn_postgis(host, port, dbname, user, password)
+    conn.autocommit = False
     cur = conn.cursor()
 
-    # 1. Obtenir timestamps en segons UNIX cada hora
+    # 1. Obtenir timestamps en segons UNIX cada dia (amb els 6 dies posteriors per a la setmana)
     dt0 = datetime.strptime(data_inicial, "%Y/%m/%d").replace(tzinfo=tz)
     delta = timedelta(hours=24)
-    timestamps = [int((dt0 + i * delta).timestamp()) for i in range(num_dies)]
-    
+    timestamps = [int((dt0 + i * delta).timestamp()) for i in range(num_dies + 6)]
+    dia0 = dt0.date()
+
     resultats: List[Optional[Any]] = []
 
+    # Les llistes són opcionals: els recomptes es calculen sumant enters
+    if amb_llistes:
+        llista_setmana = "atm.array_cat_agg(d.{col}) OVER setmana"
+    else:
+        llista_setmana = "NULL::int4[]"
+
+    pool = ThreadedConnectionPool(1, workers, host=host, port=port, dbname=dbname,
+                                  user=user, password=password)
+
+    def agrega(ts: int) -> Optional[Tuple[int, int]]:
+        conn_dia = pool.getconn()
+        try:
+            return agregaParadesDia(conn_dia, ts, tz, amb_llistes, reutilitza)
+        finally:
+            pool.putconn(conn_dia)
+
     try:
         start = time.perf_counter()
         total = len(timestamps)
-        
-        for idx, ts in enumerate(timestamps, start=1):
-            # Crear datetime object per al timestamp actual
-            dt_actual = datetime.fromtimestamp(ts, tz)
-
-            sql="delete from serveis_projectats_tmp;"
-            cur.execute(sql)
-            sql="insert into serveis_projectats_tmp select * from serveis_projectats where temps_int>=%s and temps_int<%s+(60*60*24);"
-            cur.execute(sql, (ts, ts,))
-
-            sql = """delete from sto_puntuades where dia=to_timestamp(%s)::date"""
-            cur.execute(sql, (ts,))
-
-            # SQL amb string_agg en lloc d'array_agg
-            sql = """INSERT INTO atm.sto_puntuades (
-                        stop_id, 
-                        dia, 
-                        dia_timestamp,
-                        lst_serv_arribada_dia,
-                        lst_serv_sortida_dia,
-                        lst_serv_arribada_setmana,
-                        lst_serv_sortida_setmana,
-                        num_serv_arribada_dia,
-                        num_serv_sortida_dia,
-                        num_serv_arribada_setmana,
-                        num_serv_sortida_setmana,
-                        geom	)
-                    WITH 
-                    serveis_agrupats AS (
-                        SELECT 
-                            sp.stop_id,
-                            (TO_TIMESTAMP(%s) AT TIME ZONE 'UTC')::DATE as dia_consulta,
-                            string_agg(sp.lst_serv_arribada, ',') 
-                                FILTER (WHERE sp.lst_serv_arribada != '' and sp.temps_int<%s+(60*60*24)) AS arribada_ids_dia,
-                            string_agg(sp.lst_serv_sortida, ',') 
-                                FILTER (WHERE sp.lst_serv_sortida != '' and sp.temps_int<%s+(60*60*24)) AS sortida_ids_dia,
-                            string_agg(sp.lst_serv_arribada, ',') 
-                                FILTER (WHERE sp.lst_serv_arribada != '' ) AS arribada_ids_setmana,
-                            string_agg(sp.lst_serv_sortida, ',') 
-                                FILTER (WHERE sp.lst_serv_sortida != '') AS sortida_ids_setmana
-                        FROM atm.serveis_projectats_tmp sp
-                        WHERE sp.temps_int >= %s
-                        AND sp.temps_int < %s+(60*60*24*7)
-                        AND sp.stop_id IS NOT NULL
-                        GROUP BY sp.stop_id
-                    )
-                    SELECT 
-                        so.stop_id,
-                        so.dia_consulta AS dia,
-                        so.dia_consulta::TIMESTAMP AS dia_timestamp,
-                        so.arribada_ids_dia AS lst_serv_arribada_dia,
-                        so.sortida_ids_dia AS lst_serv_sortida_dia,
-                        so.arribada_ids_setmana AS lst_serv_arribada_setmana,
-                        so.sortida_ids_setmana AS lst_serv_sortida_setmana,
-                        array_length(string_to_array(so.arribada_ids_dia, ','), 1) AS num_arribades_dia,
-                        array_length(string_to_array(so.sortida_ids_dia, ','), 1) AS num_sortides_dia,
-                        array_length(string_to_array(so.arribada_ids_setmana, ','), 1) AS num_arribades_setmana,
-                        array_length(string_to_array(so.sortida_ids_setmana, ','), 1) AS num_sortides_setmana,
-                        s.geom
-                    FROM serveis_agrupats so left join sto s on s.stop_id=so.stop_id;
-                """
-
-            cur.execute(sql, (ts,ts,ts,ts,ts))
-            
-            # Recompte de registres actualitzats
-            row_count = cur.rowcount
-            
-            # Càlcul d'ETA
-            elapsed = time.perf_counter() - start
-            avg_per_iter = elapsed / idx
-            remaining = total - idx
-            eta_secs = int(avg_per_iter * remaining)
-            eta_str = str(timedelta(seconds=eta_secs))
-            
-            dt_display = dt_actual.strftime("%d/%m/%Y %H:%M")
-            print(
-                f"[{idx}/{total}] ({ts}) {dt_display} --> registres actualitzats: {row_count} "
-                f"(ETA: {eta_str})"
-            )
-            
-            resultats.append(row_count)
+
+        # 2. Agregats diaris per parada
+        passos_total = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(agrega, ts): ts for ts in timestamps}
+            for idx, future in enumerate(as_completed(futures), start=1):
+                ts = futures[future]
+                dt_display = datetime.fromtimestamp(ts, tz).strftime("%d/%m/%Y %H:%M")
+                agregat = future.result()
+                if agregat is None:
+                    print(f"[{idx}/{total}] ({ts}) {dt_display} --> agregats diaris ja calculats")
+                    continue
+                parades, passos = agregat
+                passos_total += passos
+
+                # Càlcul d'ETA i velocitat agregada de tots els fils
+                elapsed = time.perf_counter() - start
+                avg_per_iter = elapsed / idx
+                remaining = total - idx
+                eta_secs = int(avg_per_iter * remaining)
+                eta_str = str(timedelta(seconds=eta_secs))
+
+                print(
+                    f"[{idx}/{total}] ({ts}) {dt_display} --> agregats diaris: {parades} "
+                    f"({passos_total / elapsed:.0f} passos/s, {workers} fils) (ETA: {eta_str})"
+                )
+
+        # 3. Puntuació de cada dia: xifres del dia i suma mòbil de 7 dies.
+        # La graella (parada, dia) inclou els dies sense passos, perquè la finestra
+        # de 7 files sigui de 7 dies i les parades sense passos el dia mateix hi surtin.
+        cur.execute("DELETE FROM atm.sto_puntuades WHERE dia >= %(dia0)s AND dia < %(dia0)s + %(num_dies)s",
+                    {'dia0': dia0, 'num_dies': num_dies})
+        sql = """INSERT INTO atm.sto_puntuades (
+                    stop_id,
+                    dia,
+                    dia_timestamp,
+                    lst_serv_arribada_dia,
+                    lst_serv_sortida_dia,
+                    lst_serv_arribada_setmana,
+                    lst_serv_sortida_setmana,
+                    num_serv_arribada_dia,
+                    num_serv_sortida_dia,
+                    num_serv_arribada_setmana,
+                    num_serv_sortida_setmana,
+                    geom	)
+                WITH
+                graella AS (
+                    SELECT p.stop_id, g.dia::date AS dia
+                    FROM (SELECT DISTINCT stop_id FROM atm.sto_puntuades_dia
+                          WHERE dia >= %(dia0)s AND dia < %(dia0)s + %(num_dies)s + 6) p
+                    CROSS JOIN generate_series(%(dia0)s::date, %(dia0)s::date + %(num_dies)s + 5,
+                                               interval '1 day') g(dia)
+                ),
+                mobil AS (
+                    SELECT
+                        g.stop_id,
+                        g.dia,
+                        d.lst_serv_arribada AS arribada_ids_dia,
+                        d.lst_serv_sortida AS sortida_ids_dia,
+                        {arribada_setmana} AS arribada_ids_setmana,
+                        {sortida_setmana} AS sortida_ids_setmana,
+                        d.num_serv_arribada AS num_arribada_dia,
+                        d.num_serv_sortida AS num_sortida_dia,
+                        sum(d.num_serv_arribada) OVER setmana AS num_arribada_setmana,
+                        sum(d.num_serv_sortida) OVER setmana AS num_sortida_setmana,
+                        count(d.stop_id) OVER setmana AS dies_amb_passos
+                    FROM graella g
+                    LEFT JOIN atm.sto_puntuades_dia d ON d.stop_id = g.stop_id AND d.dia = g.dia
+                    WINDOW setmana AS (PARTITION BY g.stop_id ORDER BY g.dia
+                                       ROWS BETWEEN CURRENT ROW AND 6 FOLLOWING)
+                )
+                SELECT
+                    so.stop_id,
+                    so.dia,
+                    so.dia::TIMESTAMP AS dia_timestamp,
+                    so.arribada_ids_dia AS lst_serv_arribada_dia,
+                    so.sortida_ids_dia AS lst_serv_sortida_dia,
+                    so.arribada_ids_setmana AS lst_serv_arribada_setmana,
+                    so.sortida_ids_setmana AS lst_serv_sortida_setmana,
+                    so.num_arribada_dia AS num_arribades_dia,
+                    so.num_sortida_dia AS num_sortides_dia,
+                    so.num_arribada_setmana AS num_arribades_setmana,
+                    so.num_sortida_setmana AS num_sortides_setmana,
+                    s.geom
+                FROM mobil so left join sto s on s.stop_id=so.stop_id
+                WHERE so.dia < %(dia0)s + %(num_dies)s
+                AND so.dies_amb_passos > 0;
+            """.format(arribada_setmana=llista_setmana.format(col='lst_serv_arribada'),
+                       sortida_setmana=llista_setmana.format(col='lst_serv_sortida'))
+        cur.execute(sql, {'dia0': dia0, 'num_dies': num_dies})
+        cur.execute("SELECT dia, count(*) FROM atm.sto_puntuades"
+                    " WHERE dia >= %(dia0)s AND dia < %(dia0)s + %(num_dies)s GROUP BY dia ORDER BY dia",
+                    {'dia0': dia0, 'num_dies': num_dies})
+        per_dia = dict(cur.fetchall())
+        conn.commit()
+
+        for i in range(num_dies):
+            dia = dia0 + timedelta(days=i)
+            resultats.append(per_dia.get(dia, 0))
+            print(f"{dia:%d/%m/%Y} --> parades puntuades: {resultats[-1]}")
 
         elapsed_final = time.perf_counter() - start
+        print(f"Temps total de procés: {timedelta(seconds=elapsed_final)}")
 
     except Exception:
         conn.rollback()
@@ -248,14 +613,30 @@ def creaParadesPuntuades(
     finally:
         cur.close()
         conn.close()
+        pool.closeall()
 
     return resultats
 
 if __name__ == "__main__":
-    # Exemple: processar primer arrays i després strings
-    print("=== FASE 1: Actualitzant amb arrays ===")
-    #res1 = actualitzaConnexions(data_inicial="2025/10/20", temps_espera=20, num_hores=24*10)
-    
-    print("\n=== FASE 2: Actualitzant amb string aggregation ===")
-    res2 = creaParadesPuntuades(data_inicial="2025/10/20", num_dies=10)
-    
\ No newline at end of file
+    # Exemple: processar 10 dies a partir del 20/10/2025
+    parser = argparse.ArgumentParser(description="Avalua els serveis disponibles a cada parada")
+    parser.add_argument("--data-inicial", default="2025/10/20", help="Data d'inici (YYYY/MM/DD)")
+    parser.add_argument("--dies", type=int, default=10, help="Nombre de dies")
+    parser.add_argument("--temps-espera", type=int, default=20, help="Minuts de la finestra de connexió")
+    parser.add_argument("--workers", type=int, default=1, help="Dies processats en paral·lel")
+    parser.add_argument("--fase", choices=["connexions", "puntuacio", "totes"], default="puntuacio",
+                        help="connexions: serveis connectats de cada pas; puntuacio: sto_puntuades")
+    parser.add_argument("--sense-llistes", dest="amb_llistes", action="store_false",
+                        help="Desa a sto_puntuades només els recomptes, sense les llistes int4[] dels "
+                             "serveis connectats (temp.sql i update_agencies.sql les necessiten)")
+    args = parser.parse_args()
+
+    if args.fase in ("connexions", "totes"):
+        print("=== FASE 1: Actualitzant connexions ===")
+        res1 = actualitzaConnexionsPerDies(data_inicial=args.data_inicial, temps_espera=args.temps_espera,
+                                           num_dies=args.dies, workers=args.workers)
+
+    if args.fase in ("puntuacio", "totes"):
+        print("\n=== FASE 2: Puntuant parades ===")
+        res2 = creaParadesPuntuades(data_inicial=args.data_inicial, num_dies=args.dies,
+                                    workers=args.workers, amb_llistes=args.amb_llistes)
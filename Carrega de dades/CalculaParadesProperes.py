@@ -0,0 +1,167 @@
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from datetime import timedelta
+import argparse
+import time
+
+# Construeix atm.sto_properes (parades properes de cada parada) a partir de sto.geom (EPSG:25831).
+# Cal executar-lo després de carregar el GTFS (gtfs_to_postgresql.py) i abans d'AvaluaServeisDisponibles.py.
+#   python CalculaParadesProperes.py --radi 300 --top-k 10            (només les parades canviades)
+#   python CalculaParadesProperes.py --radi 300 --top-k 10 --complet  (tota la taula)
+# Si es canvia el radi o el top-k cal fer una reconstrucció completa.
+
+def crea_conn_postgis(
+    host: str = "localhost",
+    port: int = 5432,
+    dbname: str = "meudb",
+    user: str = "postgres",
+    password: str = "secreto"
+) -> psycopg2.extensions.connection:
+    """
+    Retorna una connexió a PostGIS amb autocommit habilitat.
+    """
+    conn = psycopg2.connect(
+        host=host,
+        port=port,
+        dbname=dbname,
+        user=user,
+        password=password
+    )
+    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    return conn
+
+# Les `top_k` parades més properes (la mateixa inclosa, a 0 m) dins de `radi_m` metres de
+# cada parada de `parades`. La cerca KNN (<->) fa servir l'índex GIST de sto.geom.
+SQL_PARADES_PROPERES = """
+    INSERT INTO atm.sto_properes (stop_id, num, stop_id_propera, distancia_m)
+    SELECT
+        s.stop_id::text,
+        row_number() OVER (PARTITION BY s.stop_id ORDER BY k.distancia_m, k.stop_id),
+        k.stop_id,
+        k.distancia_m
+    FROM {parades} s
+    CROSS JOIN LATERAL (
+        SELECT p.stop_id::text AS stop_id,
+               round(ST_Distance(s.geom, p.geom)::numeric, 1) AS distancia_m
+        FROM atm.sto p
+        WHERE ST_DWithin(s.geom, p.geom, %(radi_m)s)
+        ORDER BY s.geom <-> p.geom
+        LIMIT %(top_k)s
+    ) k
+    WHERE s.geom IS NOT NULL;
+"""
+
+def actualitzaParadesProperes(
+        radi_m: float = 300,
+        top_k: int = 10,
+        complet: bool = False,
+        *,
+        host: str = "192.168.1.251",
+        port: int = 5432,
+        dbname: str = "gisdb",
+        user: str = "atm",
+        password: str = "atm"
+    ) -> int:
+    """
+    Omple atm.sto_properes amb les top_k parades més properes a cada parada
+    dins de radi_m metres.
+
+    La geometria de cada parada en el moment del càlcul es guarda a
+    atm.sto_properes_geom. Sense complet=True només es recalculen les parades
+    afectades per una recàrrega del GTFS: les noves, les eliminades, les que
+    han canviat de coordenades i les que tenen alguna d'aquestes dins del radi
+    (abans o després del canvi). Si no hi ha cap càlcul previ es fa complet.
+
+    Tot s'executa en una transacció.
+
+    Returns:
+        int: Nombre de files inserides a sto_properes
+    """
+    conn = crea_conn_postgis(host, port, dbname, user, password)
+    conn.autocommit = False
+    cur = conn.cursor()
+    params = {'radi_m': radi_m, 'top_k': top_k}
+
+    try:
+        start = time.perf_counter()
+        if not complet:
+            cur.execute("SELECT NOT EXISTS (SELECT 1 FROM atm.sto_properes_geom)")
+            complet = cur.fetchone()[0]
+
+        if complet:
+            print(f"Calculant les parades properes de totes les parades (radi {radi_m} m, top {top_k})...")
+            cur.execute("TRUNCATE atm.sto_properes")
+            cur.execute(SQL_PARADES_PROPERES.format(parades="atm.sto"), params)
+            inserides = cur.rowcount
+
+            cur.execute("TRUNCATE atm.sto_properes_geom")
+            cur.execute("INSERT INTO atm.sto_properes_geom (stop_id, geom)"
+                        " SELECT stop_id::text, geom FROM atm.sto")
+        else:
+            # Parades noves, eliminades o amb coordenades diferents del darrer càlcul
+            cur.execute("""CREATE TEMP TABLE parades_canviades ON COMMIT DROP AS
+                            SELECT coalesce(s.stop_id::text, g.stop_id) AS stop_id,
+                                   s.geom AS geom_nova,
+                                   g.geom AS geom_antiga
+                            FROM atm.sto s
+                            FULL JOIN atm.sto_properes_geom g ON g.stop_id = s.stop_id::text
+                            WHERE s.stop_id IS NULL
+                               OR g.stop_id IS NULL
+                               OR s.geom IS DISTINCT FROM g.geom""")
+            canviades = cur.rowcount
+            if canviades == 0:
+                conn.commit()
+                print("Cap parada ha canviat des del darrer càlcul")
+                return 0
+
+            # Les llistes de veïnes d'aquestes parades i de les que les tenen dins del radi
+            cur.execute("""CREATE TEMP TABLE parades_afectades ON COMMIT DROP AS
+                            SELECT stop_id FROM parades_canviades
+                            UNION
+                            SELECT s.stop_id::text
+                            FROM atm.sto s
+                            JOIN parades_canviades c
+                              ON ST_DWithin(s.geom, c.geom_nova, %(radi_m)s)
+                              OR ST_DWithin(s.geom, c.geom_antiga, %(radi_m)s)""", params)
+            afectades = cur.rowcount
+            print(f"Recalculant {afectades} parades ({canviades} canviades) "
+                  f"(radi {radi_m} m, top {top_k})...")
+
+            cur.execute("DELETE FROM atm.sto_properes"
+                        " WHERE stop_id IN (SELECT stop_id FROM parades_afectades)")
+            cur.execute(SQL_PARADES_PROPERES.format(
+                parades="(SELECT * FROM atm.sto WHERE stop_id::text IN (SELECT stop_id FROM parades_afectades))"),
+                params)
+            inserides = cur.rowcount
+
+            cur.execute("DELETE FROM atm.sto_properes_geom"
+                        " WHERE stop_id IN (SELECT stop_id FROM parades_canviades)")
+            cur.execute("INSERT INTO atm.sto_properes_geom (stop_id, geom)"
+                        " SELECT s.stop_id::text, s.geom FROM atm.sto s"
+                        " JOIN parades_canviades c ON c.stop_id = s.stop_id::text")
+
+        conn.commit()
+        cur.execute("ANALYZE atm.sto_properes")
+        conn.commit()
+
+        elapsed = time.perf_counter() - start
+        print(f"Files inserides a sto_properes: {inserides}")
+        print(f"Temps total de procés: {timedelta(seconds=elapsed)}")
+        return inserides
+
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calcula les parades properes de cada parada (sto_properes)")
+    parser.add_argument("--radi", type=float, default=300, help="Distància màxima en metres")
+    parser.add_argument("--top-k", type=int, default=10, help="Nombre màxim de parades properes per parada")
+    parser.add_argument("--complet", action="store_true",
+                        help="Recalcula totes les parades (cal si es canvia el radi o el top-k)")
+    args = parser.parse_args()
+
+    res = actualitzaParadesProperes(radi_m=args.radi, top_k=args.top_k, complet=args.complet)
@@ -40,8 +40,19 @@ CREATE TABLE atm.serveis_projectats (
 	stop_code text NULL,
 	geom public.geometry(point, 25831) NULL,
 	temps_int int4 NULL,
-	connexions_sortida numeric NULL
-);
+	connexions_sortida numeric NULL,
+	lst_serv_arribada int4[] NULL,
+	lst_serv_sortida int4[] NULL,
+	num_serv_arribada int4 NULL,
+	num_serv_sortida int4 NULL
+) PARTITION BY RANGE (temps_int);
+-- lst_serv_arribada/lst_serv_sortida: ids dels serveis connectats (AvaluaServeisDisponibles.py);
+-- num_serv_arribada/num_serv_sortida en són els recomptes, calculats en escriure-les.
+-- Per migrar les llistes antigues en text separat per comes:
+-- ALTER TABLE atm.serveis_projectats
+--     ALTER COLUMN lst_serv_arribada TYPE int4[] USING string_to_array(nullif(lst_serv_arribada, ''), ',')::int4[],
+--     ALTER COLUMN lst_serv_sortida TYPE int4[] USING string_to_array(nullif(lst_serv_sortida, ''), ',')::int4[];
+-- Els índexs es creen a totes les particions
 CREATE INDEX idx_serveis_projectats_geom_idx ON atm.serveis_projectats (geom);
 CREATE INDEX idx_serveis_projectats_id ON atm.serveis_projectats (id);
 CREATE INDEX serveis_projectats_stop_id_idx ON atm.serveis_projectats (stop_id);
@@ -50,8 +61,330 @@ CREATE INDEX serveis_projectats_temps_int_stop_id_idx ON atm.serveis_projectats
 CREATE INDEX serveis_projectats_temps_ts_idx ON atm.serveis_projectats (temps_ts);
 CREATE INDEX serveis_projectats_trip_id_idx ON atm.serveis_projectats (trip_id);
 
+-- Una partició per dia: atm.serveis_projectats_YYYYMMDD amb temps_int dins [00:00, 24:00) del dia.
+-- Les consultes per finestres de temps_int només llegeixen les particions afectades, i
+-- regenerar un dia és un TRUNCATE/DROP de la seva partició en lloc d'un DELETE + VACUUM FULL.
+-- ProjectaServeis.py crea les particions del període abans de projectar.
+-- p_taula permet fer servir les mateixes funcions per a serveis_projectats_c (format compacte).
+CREATE OR REPLACE FUNCTION atm.crea_particio_serveis_projectats(p_dia date, p_taula text DEFAULT 'serveis_projectats')
+RETURNS text AS $$
+DECLARE
+    nom text := p_taula || '_' || to_char(p_dia, 'YYYYMMDD');
+    nom_default text := p_taula || '_default';
+    t_inici int4 := extract(epoch FROM p_dia::timestamp)::int4;
+    hi_ha_files boolean := false;
+BEGIN
+    IF to_regclass('atm.' || nom) IS NULL THEN
+        -- Si la partició per defecte ja té files del dia, el CREATE fallaria: es desenganxa
+        -- la partició per defecte, es crea la del dia, s'hi mouen les files i es torna a enganxar
+        IF to_regclass('atm.' || nom_default) IS NOT NULL THEN
+            EXECUTE format('SELECT EXISTS (SELECT 1 FROM atm.%I WHERE temps_int >= %s AND temps_int < %s)',
+                           nom_default, t_inici, t_inici + 60*60*24)
+               INTO hi_ha_files;
+        END IF;
+        IF hi_ha_files THEN
+            EXECUTE format('ALTER TABLE atm.%I DETACH PARTITION atm.%I', p_taula, nom_default);
+        END IF;
+        EXECUTE format('CREATE TABLE atm.%I PARTITION OF atm.%I FOR VALUES FROM (%s) TO (%s)',
+                       nom, p_taula, t_inici, t_inici + 60*60*24);
+        IF hi_ha_files THEN
+            EXECUTE format('INSERT INTO atm.%I SELECT * FROM atm.%I WHERE temps_int >= %s AND temps_int < %s',
+                           nom, nom_default, t_inici, t_inici + 60*60*24);
+            EXECUTE format('DELETE FROM atm.%I WHERE temps_int >= %s AND temps_int < %s',
+                           nom_default, t_inici, t_inici + 60*60*24);
+            EXECUTE format('ALTER TABLE atm.%I ATTACH PARTITION atm.%I DEFAULT', p_taula, nom_default);
+        END IF;
+    END IF;
+    RETURN nom;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Buida (TRUNCATE) o elimina (DROP) la partició d'un dia
+CREATE OR REPLACE FUNCTION atm.elimina_particio_serveis_projectats(p_dia date, p_drop boolean DEFAULT true,
+                                                                    p_taula text DEFAULT 'serveis_projectats')
+RETURNS text AS $$
+DECLARE
+    nom text := p_taula || '_' || to_char(p_dia, 'YYYYMMDD');
+BEGIN
+    IF to_regclass('atm.' || nom) IS NOT NULL THEN
+        IF p_drop THEN
+            EXECUTE format('DROP TABLE atm.%I', nom);
+        ELSE
+            EXECUTE format('TRUNCATE TABLE atm.%I', nom);
+        END IF;
+    END IF;
+    RETURN nom;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Partició per defecte: les files fora de les particions creades (p.ex. un dia de més pel
+-- final del període) hi van a parar en lloc de fer fallar l'INSERT de tota la ruta.
+-- crea_particio_serveis_projectats mou a la partició nova les files del dia que hi hagin
+-- anat a parar. Per veure què hi ha: SELECT count(*) FROM atm.serveis_projectats_default;
+CREATE TABLE atm.serveis_projectats_default PARTITION OF atm.serveis_projectats DEFAULT;
+
+-- Per migrar una taula serveis_projectats no particionada:
+-- ALTER TABLE atm.serveis_projectats RENAME TO serveis_projectats_old;
+-- (crear la taula i les funcions d'aquest fitxer)
+-- SELECT atm.crea_particio_serveis_projectats(d::date)
+--     FROM generate_series((SELECT min(to_timestamp(temps_int) AT TIME ZONE 'UTC')::date FROM atm.serveis_projectats_old),
+--                          (SELECT max(to_timestamp(temps_int) AT TIME ZONE 'UTC')::date FROM atm.serveis_projectats_old),
+--                          interval '1 day') d;
+-- INSERT INTO atm.serveis_projectats SELECT * FROM atm.serveis_projectats_old;
+-- DROP TABLE atm.serveis_projectats_old;
+-- Si les funcions ja existien amb la signatura anterior (sense p_taula):
+-- DROP FUNCTION atm.crea_particio_serveis_projectats(date);
+-- DROP FUNCTION atm.elimina_particio_serveis_projectats(date, boolean);
+
+-------------------------------------------------------------
+-- FORMAT COMPACTE DE SERVEIS PROJECTATS (ProjectaServeis.py --motor vectorial --format compacte)
+--
+-- Cada pas només guarda claus enteres i temps en segons epoch. La resta de columnes
+-- de serveis_projectats (dies de la setmana, dates del servei, route_id, stop_code,
+-- geom, hores GTFS en text, ...) es guarden a les taules de claus i es recuperen a la
+-- vista atm.v_serveis_projectats_c, que manté els noms de columna de serveis_projectats.
+-- La vista no llegeix les taules GTFS (cal, sto_t, sto), que es poden recarregar
+-- (DROP + CREATE) sense haver-la d'eliminar.
+
+-- Claus enteres estables dels identificadors GTFS (no canvien en recarregar el GTFS)
+CREATE TABLE atm.sp_rutes (
+	route_key int4 GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+	route_id text NOT NULL UNIQUE
+);
+
+CREATE TABLE atm.sp_parades (
+	stop_key int4 GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+	stop_id text NOT NULL UNIQUE,
+	stop_code text NULL,
+	geom public.geometry(point, 25831) NULL
+);
+
+-- Serveis i viatges es guarden per versions: cada contingut diferent (hash) té la seva clau,
+-- i una recàrrega del GTFS que els canvia afegeix versions noves en lloc de modificar les
+-- que fan servir els dies ja projectats a serveis_projectats_c.
+
+-- Atributs del calendari de cada versió d'un servei (de cal)
+CREATE TABLE atm.sp_serveis (
+	servei_key int4 GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+	service_id text NOT NULL,
+	monday int4 NULL,
+	tuesday int4 NULL,
+	wednesday int4 NULL,
+	thursday int4 NULL,
+	friday int4 NULL,
+	saturday int4 NULL,
+	sunday int4 NULL,
+	start_date date NULL,
+	end_date date NULL,
+	hash text NOT NULL UNIQUE
+);
+
+-- Versió d'un viatge: ruta, servei (versió del calendari si és a cal) i passos (hash de sto_t)
+CREATE TABLE atm.sp_viatges (
+	trip_key int4 GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+	trip_id text NOT NULL,
+	route_key int4 NOT NULL REFERENCES atm.sp_rutes (route_key),
+	service_id text NOT NULL,
+	servei_key int4 NULL REFERENCES atm.sp_serveis (servei_key),
+	hash text NOT NULL UNIQUE
+);
+CREATE INDEX sp_viatges_trip_id_idx ON atm.sp_viatges (trip_id);
+
+-- Hores GTFS i distància de cada pas d'una versió d'un viatge (de sto_t)
+CREATE TABLE atm.sp_passos (
+	trip_key int4 NOT NULL REFERENCES atm.sp_viatges (trip_key),
+	stop_sequence int4 NOT NULL,
+	arrival_time text NULL,
+	departure_time text NULL,
+	shape_dist_traveled int4 NULL,
+	CONSTRAINT sp_passos_pkey PRIMARY KEY (trip_key, stop_sequence)
+);
+
+-- Versió de cada viatge al GTFS carregat: ProjectaServeis.py hi llegeix la trip_key de cada trip_id.
+-- Es torna a omplir a cada crida de actualitza_claus_serveis_projectats().
+CREATE TABLE atm.sp_viatges_actuals (
+	trip_id text PRIMARY KEY,
+	trip_key int4 NOT NULL REFERENCES atm.sp_viatges (trip_key)
+);
+
+-- Afegeix les claus de les rutes i parades noves de tri, sto i sto_t (i actualitza els
+-- atributs de les parades), i les versions noves dels serveis i viatges de cal, tri i sto_t
+CREATE OR REPLACE FUNCTION atm.actualitza_claus_serveis_projectats()
+RETURNS void AS $$
+BEGIN
+    INSERT INTO atm.sp_rutes (route_id)
+        SELECT DISTINCT route_id::text FROM atm.tri
+        ON CONFLICT (route_id) DO NOTHING;
+    INSERT INTO atm.sp_parades (stop_id, stop_code, geom)
+        SELECT stop_id::text, stop_code::text, geom FROM atm.sto
+        ON CONFLICT (stop_id) DO UPDATE
+            SET stop_code = EXCLUDED.stop_code, geom = EXCLUDED.geom
+            WHERE (sp_parades.stop_code, sp_parades.geom)
+                  IS DISTINCT FROM (EXCLUDED.stop_code, EXCLUDED.geom);
+    -- Parades dels horaris que no són a sto (queden sense atributs)
+    INSERT INTO atm.sp_parades (stop_id)
+        SELECT DISTINCT stop_id::text FROM atm.sto_t
+        ON CONFLICT (stop_id) DO NOTHING;
+
+    INSERT INTO atm.sp_serveis (service_id, monday, tuesday, wednesday, thursday, friday, saturday, sunday,
+                                start_date, end_date, hash)
+        SELECT s.*, md5(s::text)
+        FROM (SELECT service_id::text, monday::int4, tuesday::int4, wednesday::int4, thursday::int4,
+                     friday::int4, saturday::int4, sunday::int4,
+                     to_date(start_date::text, 'YYYYMMDD'), to_date(end_date::text, 'YYYYMMDD')
+              FROM atm.cal) s
+        ON CONFLICT (hash) DO NOTHING;
+
+    -- Contingut actual de cada viatge; el hash dels passos es calcula com a sp_passos
+    CREATE TEMP TABLE sp_viatges_gtfs AS
+    SELECT v.*, md5(v::text) AS hash
+    FROM (SELECT t.trip_id::text AS trip_id, r.route_key, t.service_id::text AS service_id,
+                 sv.servei_key, p.hash_passos
+          FROM atm.tri t
+              JOIN atm.sp_rutes r ON r.route_id = t.route_id::text
+              LEFT JOIN (SELECT s.service_id, md5(s::text) AS hash
+                         FROM (SELECT service_id::text, monday::int4, tuesday::int4, wednesday::int4,
+                                      thursday::int4, friday::int4, saturday::int4, sunday::int4,
+                                      to_date(start_date::text, 'YYYYMMDD'), to_date(end_date::text, 'YYYYMMDD')
+                               FROM atm.cal) s) c ON c.service_id = t.service_id::text
+              LEFT JOIN atm.sp_serveis sv ON sv.hash = c.hash
+              LEFT JOIN (SELECT st.trip_id::text AS trip_id,
+                                md5(string_agg(ROW(st.stop_sequence::int4, st.arrival_time::text,
+                                                   st.departure_time::text,
+                                                   round(st.shape_dist_traveled)::int4)::text,
+                                               ',' ORDER BY st.stop_sequence)) AS hash_passos
+                         FROM atm.sto_t st GROUP BY st.trip_id) p ON p.trip_id = t.trip_id::text) v;
+
+    INSERT INTO atm.sp_viatges (trip_id, route_key, service_id, servei_key, hash)
+        SELECT trip_id, route_key, service_id, servei_key, hash FROM sp_viatges_gtfs
+        ON CONFLICT (hash) DO NOTHING;
+    TRUNCATE atm.sp_viatges_actuals;
+    INSERT INTO atm.sp_viatges_actuals (trip_id, trip_key)
+        SELECT g.trip_id, v.trip_key
+        FROM sp_viatges_gtfs g JOIN atm.sp_viatges v ON v.hash = g.hash;
+    -- Les versions existents ja tenen els mateixos passos: només s'afegeixen els de les noves
+    INSERT INTO atm.sp_passos (trip_key, stop_sequence, arrival_time, departure_time, shape_dist_traveled)
+        SELECT a.trip_key, st.stop_sequence, st.arrival_time::text, st.departure_time::text,
+               round(st.shape_dist_traveled)::int4
+        FROM atm.sto_t st JOIN atm.sp_viatges_actuals a ON a.trip_id = st.trip_id::text
+        WHERE NOT EXISTS (SELECT 1 FROM atm.sp_passos ps WHERE ps.trip_key = a.trip_key)
+        ON CONFLICT (trip_key, stop_sequence) DO NOTHING;
+    DROP TABLE sp_viatges_gtfs;
+END;
+$$ LANGUAGE plpgsql
+-- Els hash inclouen dates en text: el format no ha de dependre de la sessió
+SET DateStyle = 'ISO, YMD';
+
+CREATE TABLE atm.serveis_projectats_c (
+	id int4 DEFAULT nextval('serveis_projectats_seq'::regclass) NOT NULL,
+	temps_int int4 NOT NULL,
+	dia date NOT NULL,
+	trip_key int4 NOT NULL,
+	stop_key int4 NOT NULL,
+	stop_sequence int4 NOT NULL
+) PARTITION BY RANGE (temps_int);
+CREATE INDEX serveis_projectats_c_temps_int_stop_key_idx ON atm.serveis_projectats_c (temps_int, stop_key);
+CREATE INDEX serveis_projectats_c_trip_key_idx ON atm.serveis_projectats_c (trip_key);
+-- Particions: SELECT atm.crea_particio_serveis_projectats(dia, 'serveis_projectats_c');
+CREATE TABLE atm.serveis_projectats_c_default PARTITION OF atm.serveis_projectats_c DEFAULT;
+
+-- Vista amb les columnes de serveis_projectats (sense les columnes de connexions)
+CREATE OR REPLACE VIEW atm.v_serveis_projectats_c AS
+SELECT
+	c.id,
+	to_timestamp(c.temps_int) AT TIME ZONE 'UTC' AS temps_ts,
+	c.dia::timestamp AS dia,
+	extract(dow FROM c.dia)::int4 AS dow,
+	sv.monday,
+	sv.tuesday,
+	sv.wednesday,
+	sv.thursday,
+	sv.friday,
+	sv.saturday,
+	sv.sunday,
+	v.service_id,
+	sv.start_date,
+	sv.end_date,
+	v.trip_id,
+	r.route_id,
+	p.stop_id,
+	c.stop_sequence,
+	ps.arrival_time,
+	ps.departure_time,
+	ps.shape_dist_traveled,
+	p.stop_code,
+	p.geom,
+	c.temps_int
+FROM atm.serveis_projectats_c c
+	JOIN atm.sp_viatges v ON v.trip_key = c.trip_key
+	JOIN atm.sp_rutes r ON r.route_key = v.route_key
+	JOIN atm.sp_parades p ON p.stop_key = c.stop_key
+	LEFT JOIN atm.sp_serveis sv ON sv.servei_key = v.servei_key
+	LEFT JOIN atm.sp_passos ps ON ps.trip_key = c.trip_key AND ps.stop_sequence = c.stop_sequence;
+-- Per migrar la vista anterior, que llegia cal, sto_t i sto:
+-- DROP VIEW atm.v_serveis_projectats_c;
+-- ALTER TABLE atm.sp_parades ADD COLUMN stop_code text NULL, ADD COLUMN geom public.geometry(point, 25831) NULL;
+-- (crear sp_serveis, sp_passos, la funció i la vista d'aquest fitxer)
+-- SELECT atm.actualitza_claus_serveis_projectats();
+-- Per migrar de les taules de claus sense versions (sp_serveis per service_id, sp_viatges per
+-- trip_id) i stop_sequence int2. Es conserven les trip_key existents; els viatges que no
+-- coincideixin amb el GTFS actual rebran una versió nova a la crida següent de la funció:
+-- DROP VIEW atm.v_serveis_projectats_c;
+-- ALTER TABLE atm.serveis_projectats_c ALTER COLUMN stop_sequence TYPE int4;
+-- ALTER TABLE atm.sp_serveis DROP CONSTRAINT sp_serveis_pkey,
+--     ADD COLUMN servei_key int4 GENERATED ALWAYS AS IDENTITY PRIMARY KEY, ADD COLUMN hash text;
+-- SET DateStyle = 'ISO, YMD';
+-- UPDATE atm.sp_serveis SET hash = md5(ROW(service_id, monday, tuesday, wednesday, thursday, friday,
+--     saturday, sunday, start_date, end_date)::text);
+-- ALTER TABLE atm.sp_serveis ALTER COLUMN hash SET NOT NULL, ADD CONSTRAINT sp_serveis_hash_key UNIQUE (hash);
+-- ALTER TABLE atm.sp_viatges DROP CONSTRAINT sp_viatges_trip_id_key,
+--     ADD COLUMN servei_key int4 NULL REFERENCES atm.sp_serveis (servei_key), ADD COLUMN hash text;
+-- UPDATE atm.sp_viatges v SET servei_key = s.servei_key FROM atm.sp_serveis s WHERE s.service_id = v.service_id;
+-- UPDATE atm.sp_viatges v SET hash = md5(ROW(v.trip_id, v.route_key, v.service_id, v.servei_key,
+--     (SELECT md5(string_agg(ROW(ps.stop_sequence, ps.arrival_time, ps.departure_time,
+--                                ps.shape_dist_traveled)::text, ',' ORDER BY ps.stop_sequence))
+--      FROM atm.sp_passos ps WHERE ps.trip_key = v.trip_key))::text);
+-- ALTER TABLE atm.sp_viatges ALTER COLUMN hash SET NOT NULL, ADD CONSTRAINT sp_viatges_hash_key UNIQUE (hash);
+-- CREATE INDEX sp_viatges_trip_id_idx ON atm.sp_viatges (trip_id);
+-- (crear sp_viatges_actuals, la funció i la vista d'aquest fitxer)
+-- SELECT atm.actualitza_claus_serveis_projectats();
+
+-------------------------------------------------------------
+-- atm.serveis_projectats_ckpt definition
+-- Control de les rutes projectades per cada període (permet reprendre ProjectaServeis.py)
+--   INICIAT: la projecció de la ruta ha començat però no s'ha confirmat
+--   COMPLETAT: els serveis de la ruta estan confirmats a serveis_projectats
+-- taula: serveis_projectats o serveis_projectats_c
+-- motor: sql o vectorial; cada motor té els seus checkpoints perquè no projecten la mateixa
+-- finestra (sql: dies de data_inici a data_fi; vectorial: [data_inici, data_inici + periode)).
+
+-- Drop table
+
+-- DROP TABLE atm.serveis_projectats_ckpt;
+
+CREATE TABLE atm.serveis_projectats_ckpt (
+	taula text DEFAULT 'serveis_projectats' NOT NULL,
+	motor text DEFAULT 'sql' NOT NULL,
+	route_id text NOT NULL,
+	data_inici date NOT NULL,
+	data_fi date NOT NULL,
+	estat text NOT NULL,
+	inici_ts timestamptz DEFAULT now() NOT NULL,
+	fi_ts timestamptz NULL,
+	CONSTRAINT serveis_projectats_ckpt_pkey PRIMARY KEY (taula, motor, route_id, data_inici, data_fi)
+);
+-- Per migrar una taula de checkpoints sense les columnes taula i motor (els checkpoints
+-- existents passen a ser del motor sql; els del vectorial es poden esborrar i regenerar):
+-- ALTER TABLE atm.serveis_projectats_ckpt ADD COLUMN IF NOT EXISTS taula text DEFAULT 'serveis_projectats' NOT NULL;
+-- ALTER TABLE atm.serveis_projectats_ckpt ADD COLUMN motor text DEFAULT 'sql' NOT NULL;
+-- ALTER TABLE atm.serveis_projectats_ckpt DROP CONSTRAINT serveis_projectats_ckpt_pkey,
+--     ADD CONSTRAINT serveis_projectats_ckpt_pkey PRIMARY KEY (taula, motor, route_id, data_inici, data_fi);
+CREATE INDEX serveis_projectats_route_id_dia_idx ON atm.serveis_projectats (route_id, dia);
+
 -------------------------------------------------------------
 -- atm.serveis_projectats_tmp definition
+-- AvaluaServeisDisponibles.py ja no la fa servir: cada execució treballa amb taules
+-- temporals de la seva sessió (TEMP), i se'n poden llançar diverses alhora.
 
 -- Drop table
 
@@ -105,6 +438,15 @@ CREATE TABLE atm.sto_properes (
 CREATE INDEX sto_properes_stop_id_idx ON atm.sto_properes USING btree (stop_id);
 CREATE INDEX sto_properes_stop_id_propera_idx ON atm.sto_properes USING btree (stop_id_propera);
 CREATE INDEX sto_properes_stop_id_sto_properes_idx ON atm.sto_properes USING btree (stop_id, stop_id_propera);
+-- La calcula CalculaParadesProperes.py: les top-k parades dins d'un radi (num = ordre de proximitat,
+-- la mateixa parada inclosa a 0 m).
+
+-- Geometria de cada parada en el darrer càlcul de sto_properes, per recalcular només les que canvien
+CREATE TABLE atm.sto_properes_geom (
+	stop_id varchar NOT NULL,
+	geom public.geometry(point, 25831) NULL,
+	CONSTRAINT sto_properes_geom_pkey PRIMARY KEY (stop_id)
+);
 
 
 
@@ -197,6 +539,8 @@ CREATE INDEX sto_serv_disp_temps_int_idx ON atm.sto_serv_disp USING btree (temps
 
 -- CREACIÓ DE LA TAULA TEMPORAL DE CÀCUL
 -- atm.serveis_projectats_tmp definition
+-- AvaluaServeisDisponibles.py ja no la fa servir: cada execució treballa amb taules
+-- temporals de la seva sessió (TEMP), i se'n poden llançar diverses alhora.
 -- Drop table
 -- DROP TABLE atm.serveis_projectats_tmp;
 CREATE TABLE atm.serveis_projectats_tmp (
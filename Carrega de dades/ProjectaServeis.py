@@ -1,16 +1,27 @@
 import psycopg2
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from psycopg2.pool import ThreadedConnectionPool
 from datetime import datetime, timedelta, timezone
-from typing import List, Optional, Any
+from typing import List, Optional, Any, Tuple
+import argparse
 import ast
+import io
+import queue
+import threading
 import time  # nou
 
+import numpy as np
+import pandas as pd
+
 #BCN-->WHERE ST_Within(s.geom,ST_MakeEnvelope(424200, 4600000, 438900, 4605000, 25831))\
 
-# Per regenerar la taula de serveis_projectats
-    # delete from serveis_projectats ;
-    # VACUUM (FULL, ANALYZE) serveis_projectats;
-    # REINDEX TABLE serveis_projectats;
+# Per regenerar un període de serveis_projectats (particionada per dia de temps_int)
+    # python ProjectaServeis.py --data-inici YYYY/MM/DD --periode H --regenera
+    # (elimina les particions dels dies del període i els seus checkpoints abans de projectar;
+    # del dia següent a data_fi, compartit amb el període posterior, només n'esborra les files)
+    # Amb --motor vectorial --format compacte es regeneren les de serveis_projectats_c
+# Si una execució s'interromp no cal regenerar-la: en tornar-la a llançar amb les mateixes
+# dates se salten les rutes completades (serveis_projectats_ckpt) i només es neteja la parcial.
 
 def crea_conn_postgis(
     host: str = "localhost",
@@ -32,6 +43,62 @@ def crea_conn_postgis(
     conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
     return conn
 
+def temps_int_dia(data: str) -> int:
+    """
+    Retorna el temps_int (segons des de 1970-01-01, sense zona horària, com
+    crea_particio_serveis_projectats) de les 00:00 d'una data en format 'YYYY/MM/DD'.
+    """
+    return int((datetime.strptime(data, "%Y/%m/%d") - datetime(1970, 1, 1)).total_seconds())
+
+
+def crea_particions(
+        conn: psycopg2.extensions.connection,
+        data_inici: str,
+        num_dies: int,
+        taula: str = "serveis_projectats"
+    ) -> None:
+    """
+    Crea, si no existeixen, les particions diàries de `taula` (serveis_projectats
+    o serveis_projectats_c) dels `num_dies` dies a partir de data_inici (format 'YYYY/MM/DD').
+    """
+    dia0 = datetime.strptime(data_inici, "%Y/%m/%d").date()
+    cur = conn.cursor()
+    try:
+        for i in range(num_dies):
+            cur.execute("SELECT atm.crea_particio_serveis_projectats(%s, %s);",
+                        (dia0 + timedelta(days=i), taula,))
+        conn.commit()
+    finally:
+        cur.close()
+
+
+def elimina_particions(
+        conn: psycopg2.extensions.connection,
+        data_inici: str,
+        num_dies: int,
+        taula: str = "serveis_projectats"
+    ) -> None:
+    """
+    Elimina les particions diàries de `taula` (serveis_projectats o
+    serveis_projectats_c) dels `num_dies` dies a partir de data_inici (format
+    'YYYY/MM/DD') i els checkpoints dels dos motors de les projeccions a `taula`
+    que comencen en aquests dies.
+    """
+    dia0 = datetime.strptime(data_inici, "%Y/%m/%d").date()
+    cur = conn.cursor()
+    try:
+        for i in range(num_dies):
+            cur.execute("SELECT atm.elimina_particio_serveis_projectats(%s, true, %s);",
+                        (dia0 + timedelta(days=i), taula,))
+        cur.execute(
+            "DELETE FROM atm.serveis_projectats_ckpt WHERE taula = %s AND data_inici >= %s AND data_inici < %s;",
+            (taula, dia0, dia0 + timedelta(days=num_dies),)
+        )
+        conn.commit()
+    finally:
+        cur.close()
+
+
 def processar_dades(
         data_inici: str,
         periode: int,
@@ -40,7 +107,9 @@ def processar_dades(
         dbname: str = "gisdb",
         user: str = "atm",
         password: str = "atm",
-        tz: timezone = timezone.utc
+        tz: timezone = timezone.utc,
+        workers: int = 1,
+        regenera: bool = False
     ) -> None:
     """
     Processa les dades de rutes GTFS per un període determinat.
@@ -54,10 +123,34 @@ def processar_dades(
         user: Usuari de la base de dades
         password: Contrasenya de la base de dades
         tz: Zona horària (no utilitzada actualment)
+        workers: Nombre de rutes projectades en paral·lel (una connexió per fil)
+        regenera: Elimina primer les particions de data_inici a data_fi, els
+            checkpoints del període i les files del període del dia següent
     """
     finestra = timedelta(hours=periode)
     data_fi = (datetime.strptime(data_inici, "%Y/%m/%d") + finestra).strftime("%Y/%m/%d")
     conn = crea_conn_postgis(host, port, dbname, user, password)
+
+    # Particions diàries de data_inici a data_fi (inclòs, com la neteja de les rutes parcials),
+    # més el dia següent per als viatges de data_fi que passen de mitjanit
+    num_dies = (datetime.strptime(data_fi, "%Y/%m/%d") - datetime.strptime(data_inici, "%Y/%m/%d")).days + 2
+    if regenera:
+        # La partició del dia següent a data_fi la comparteix el període posterior: no s'elimina,
+        # només se n'esborren les files dels viatges de fins a data_fi
+        print(f"Eliminant les particions de {num_dies - 1} dies a partir de {data_inici}...")
+        elimina_particions(conn, data_inici, num_dies - 1)
+        t_seguent = temps_int_dia(data_fi) + 60*60*24
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                "DELETE FROM atm.serveis_projectats\
+                    WHERE temps_int >= %s AND temps_int < %s AND dia <= to_date(%s, 'YYYY/MM/DD');",
+                (t_seguent, t_seguent + 60*60*24, data_fi,)
+            )
+            print(f"Esborrades {cur.rowcount} files del dia següent a {data_fi}")
+        finally:
+            cur.close()
+    crea_particions(conn, data_inici, num_dies)
     
     # Primer actualitzem la taula serveis_tmp
     print("Actualitzant taula serveis_tmp...")
@@ -79,65 +172,549 @@ def processar_dades(
     
     # Ara continuem amb el processament normal
     cur1 = conn.cursor()
-    cur2 = conn.cursor()
 
-    sql="SELECT DISTINCT t.route_id as route_id\
+    # Rutes actives al període, de més a menys passos (sto_t) per evitar una cua llarga al final
+    sql="SELECT t.route_id as route_id, count(st.trip_id) as num_passos\
         FROM atm.cal c\
-            LEFT JOIN atm.tri t ON c.service_id = t.service_id\
-            --LEFT JOIN atm.sto_t st ON t.trip_id = st.trip_id\
-            --LEFT JOIN atm.sto s ON st.stop_id = s.stop_id\
+            JOIN atm.tri t ON c.service_id = t.service_id\
+            LEFT JOIN atm.sto_t st ON t.trip_id = st.trip_id\
             WHERE to_date(c.start_date::text, 'YYYYMMDD') <= to_date(%s, 'YYYY/MM/DD')\
             AND to_date(c.end_date::text, 'YYYYMMDD')   >= to_date(%s, 'YYYY/MM/DD')\
-        order by route_id;"
+        GROUP BY t.route_id\
+        order by num_passos desc, route_id;"
     # ST_Within(s.geom,ST_MakeEnvelope(424200, 4600000, 438900, 4605000, 25831)) AND 
     # # and s.stop_id in ('COS_19100','COS_19150','COS_16131') \  
 
-    cur1.execute(sql, (data_inici, data_fi,));
+    try:
+        cur1.execute(sql, (data_inici, data_fi,))
+        rutes: List[Tuple[str, int]] = cur1.fetchall()
+    finally:
+        cur1.close()
+        conn.close()
+
+    projecta_rutes(rutes, data_inici, data_fi, workers,
+                   host=host, port=port, dbname=dbname, user=user, password=password)
 
+
+def llegeix_checkpoints(
+        conn: psycopg2.extensions.connection,
+        data_inici: str,
+        data_fi: str,
+        taula: str = "serveis_projectats",
+        motor: str = "sql"
+    ) -> dict:
+    """
+    Retorna l'estat (INICIAT o COMPLETAT) de cada ruta ja projectada a `taula`
+    pel `motor` (sql o vectorial) per al període [data_inici, data_fi] (format
+    'YYYY/MM/DD'), segons serveis_projectats_ckpt.
+    """
+    cur = conn.cursor()
     try:
-        start = time.perf_counter()  # iniciem mesura
-        i = 0
-        total = cur1.rowcount
-        eta_secs = 0  # inicialitzar per evitar errors
-        elapsed = 0   # inicialitzar per evitar errors
-        
-        for row in cur1:
-            i+=1
+        cur.execute(
+            "SELECT route_id, estat FROM atm.serveis_projectats_ckpt\
+                WHERE taula = %s AND motor = %s\
+                AND data_inici = to_date(%s, 'YYYY/MM/DD') AND data_fi = to_date(%s, 'YYYY/MM/DD');",
+            (taula, motor, data_inici, data_fi,)
+        )
+        return dict(cur.fetchall())
+    finally:
+        cur.close()
+
+
+def projecta_ruta(
+        conn: psycopg2.extensions.connection,
+        route_id: str,
+        data_inici: str,
+        data_fi: str,
+        parcial: bool = False
+    ) -> None:
+    """
+    Projecta una ruta dins una transacció i en deixa constància a serveis_projectats_ckpt.
 
-            sql=f"select atm.projecta_serveis_route('{row[0]}', to_date('{data_inici}', 'YYYY/MM/DD'), to_date('{data_fi}', 'YYYY/MM/DD'))"
-            cur2.execute(
-                "select atm.projecta_serveis_route(%s, to_date(%s, 'YYYY/MM/DD'), to_date(%s, 'YYYY/MM/DD'));",
-                (row[0], data_inici, data_fi,)  # tuple amb un sol element
+    Abans de començar es marca la ruta com a INICIAT (fora de la transacció, perquè
+    quedi constància si el procés mor). Els serveis de la ruta i la marca COMPLETAT
+    es confirmen junts, de manera que una ruta COMPLETAT sempre té totes les files.
+
+    Args:
+        conn: Connexió (sense autocommit)
+        route_id: Ruta a projectar
+        data_inici: Data d'inici en format 'YYYY/MM/DD'
+        data_fi: Data de fi en format 'YYYY/MM/DD'
+        parcial: La ruta havia quedat a mitges en una execució anterior i
+            se n'esborren primer les files del període
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "INSERT INTO atm.serveis_projectats_ckpt (taula, motor, route_id, data_inici, data_fi, estat)\
+                VALUES ('serveis_projectats', 'sql', %s, to_date(%s, 'YYYY/MM/DD'), to_date(%s, 'YYYY/MM/DD'), 'INICIAT')\
+            ON CONFLICT (taula, motor, route_id, data_inici, data_fi)\
+                DO UPDATE SET estat = 'INICIAT', inici_ts = now(), fi_ts = NULL;",
+            (route_id, data_inici, data_fi,)
+        )
+        conn.commit()
+
+        if parcial:
+            # El filtre per temps_int limita l'esborrat a les particions del període (fins
+            # al dia següent a data_fi, pels viatges que passen de mitjanit)
+            cur.execute(
+                "DELETE FROM atm.serveis_projectats\
+                    WHERE route_id = %s\
+                    AND temps_int >= %s AND temps_int < %s\
+                    AND dia >= to_date(%s, 'YYYY/MM/DD') AND dia <= to_date(%s, 'YYYY/MM/DD');",
+                (route_id, temps_int_dia(data_inici), temps_int_dia(data_fi) + 2*60*60*24,
+                 data_inici, data_fi,)
             )
-            row_in = cur2.fetchone()
-            
-            # Càlcul d’ETA
+
+        cur.execute(
+            "select atm.projecta_serveis_route(%s, to_date(%s, 'YYYY/MM/DD'), to_date(%s, 'YYYY/MM/DD'));",
+            (route_id, data_inici, data_fi,)
+        )
+        cur.fetchone()
+
+        cur.execute(
+            "UPDATE atm.serveis_projectats_ckpt SET estat = 'COMPLETAT', fi_ts = now()\
+                WHERE taula = 'serveis_projectats' AND motor = 'sql' AND route_id = %s\
+                AND data_inici = to_date(%s, 'YYYY/MM/DD') AND data_fi = to_date(%s, 'YYYY/MM/DD');",
+            (route_id, data_inici, data_fi,)
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def projecta_rutes(
+        rutes: List[Tuple[str, int]],
+        data_inici: str,
+        data_fi: str,
+        workers: int = 1,
+        *,
+        host: str = "192.168.1.251",
+        port: int = 5432,
+        dbname: str = "gisdb",
+        user: str = "atm",
+        password: str = "atm"
+    ) -> None:
+    """
+    Crida atm.projecta_serveis_route per cada ruta amb `workers` fils en paral·lel.
+
+    Les rutes es reparteixen amb una cua compartida en l'ordre rebut (de més a menys
+    passos). Cada fil té la seva connexió del pool, de manera que hi ha `workers`
+    backends de PostgreSQL treballant alhora. El progrés i l'ETA es calculen sobre
+    el total de passos (sto_t) de totes les rutes, no per ruta.
+
+    L'execució es pot reprendre: les rutes COMPLETAT a serveis_projectats_ckpt per
+    aquest període se salten, i les que havien quedat INICIAT es tornen a projectar
+    després d'esborrar-ne les files parcials.
+
+    Args:
+        rutes: Llista de (route_id, num_passos)
+        data_inici: Data d'inici en format 'YYYY/MM/DD'
+        data_fi: Data de fi en format 'YYYY/MM/DD'
+        workers: Nombre de fils i connexions
+    """
+    pool = ThreadedConnectionPool(workers, workers, host=host, port=port,
+                                  dbname=dbname, user=user, password=password)
+
+    # Estat de les rutes en execucions anteriors del mateix període
+    conn = pool.getconn()
+    try:
+        checkpoints = llegeix_checkpoints(conn, data_inici, data_fi)
+        conn.commit()
+    finally:
+        pool.putconn(conn)
+
+    completades = [ruta for ruta in rutes if checkpoints.get(ruta[0]) == 'COMPLETAT']
+    if completades:
+        print(f"Se salten {len(completades)} rutes ja projectades en una execució anterior")
+    rutes = [ruta for ruta in rutes if checkpoints.get(ruta[0]) != 'COMPLETAT']
+
+    cua: "queue.Queue[Tuple[str, int]]" = queue.Queue()
+    for ruta in rutes:
+        cua.put(ruta)
+
+    lock = threading.Lock()
+    errors: List[BaseException] = []
+    total_rutes = len(rutes)
+    total_passos = sum(num_passos for _, num_passos in rutes) or 1
+    fet = {'rutes': 0, 'passos': 0}
+
+    def treballador() -> None:
+        conn = pool.getconn()
+        try:
+            while not errors:
+                try:
+                    route_id, num_passos = cua.get_nowait()
+                except queue.Empty:
+                    return
+                projecta_ruta(conn, route_id, data_inici, data_fi,
+                              parcial=checkpoints.get(route_id) == 'INICIAT')
+                with lock:
+                    fet['rutes'] += 1
+                    fet['passos'] += num_passos
+        except Exception as e:
+            with lock:
+                errors.append(e)
+            print(f"Error projectant rutes: {e}")
+        finally:
+            pool.putconn(conn)
+
+    fils = [threading.Thread(target=treballador, daemon=True) for _ in range(workers)]
+    start = time.perf_counter()  # iniciem mesura
+    try:
+        for fil in fils:
+            fil.start()
+
+        while any(fil.is_alive() for fil in fils):
+            fils_vius = [fil for fil in fils if fil.is_alive()]
+            fils_vius[0].join(timeout=5)
+
+            # Càlcul d'ETA sobre els passos projectats per tots els fils
+            with lock:
+                rutes_fetes, passos_fets = fet['rutes'], fet['passos']
             elapsed = time.perf_counter() - start
-            avg_per_iter = elapsed / i
-            remaining = total - i
-            eta_secs = int(avg_per_iter * remaining)
-            eta_str = str(timedelta(seconds=eta_secs))
-            
-            print( f"ROUTE: {row[0]} ->[{i}/{total}] ETA: {eta_str})" )
+            eta_secs = int(elapsed / passos_fets * (total_passos - passos_fets)) if passos_fets else 0
+            print(f"RUTES: [{rutes_fetes}/{total_rutes}] passos: {passos_fets}/{total_passos} "
+                  f"({workers} fils) ETA: {timedelta(seconds=eta_secs)}")
+
+        if errors:
+            raise errors[0]
 
         # Càlcul final del temps total
         elapsed = time.perf_counter() - start
         print(f"Temps total de procés: {timedelta(seconds=elapsed)}")
+    finally:
+        pool.closeall()
 
 
-    except psycopg2.Error as e:
-        print(f"Error de base de dades: {e}")
-        conn.rollback()
-        raise
-    except Exception as e:
-        print(f"Error general durant el processament: {e}")
-        conn.rollback()
-        raise
+DIES_SETMANA = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+# Columnes de serveis_projectats que omple el motor vectorial (id el posa la seqüència)
+COLUMNES_PROJECCIO = [
+    'temps_ts', 'dia', 'dow', *DIES_SETMANA, 'service_id', 'start_date', 'end_date',
+    'trip_id', 'route_id', 'stop_id', 'stop_sequence', 'arrival_time', 'departure_time',
+    'shape_dist_traveled', 'stop_code', 'geom', 'temps_int'
+]
+
+# Columnes de serveis_projectats_c (format compacte); la resta es recuperen a v_serveis_projectats_c
+COLUMNES_COMPACTES = ['temps_int', 'dia', 'trip_key', 'stop_key', 'stop_sequence']
+
+
+def segons_gtfs(hores: pd.Series) -> pd.Series:
+    """
+    Converteix hores GTFS 'HH:MM:SS' a segons des de l'inici del dia de servei.
+    Accepta hores posteriors a les 24:00 (p.ex. '25:10:00'); les buides queden com NaN.
+    """
+    parts = hores.str.strip().str.split(':', expand=True)
+    return (parts[0].astype(float) * 3600
+            + parts[1].astype(float) * 60
+            + parts[2].astype(float))
+
+
+def dies_servei_actius(cal: pd.DataFrame, cal_d: pd.DataFrame, dies: pd.DatetimeIndex) -> pd.DataFrame:
+    """
+    Retorna les parelles (service_id, dia) actives dins de `dies`.
+
+    Un servei és actiu un dia si el dia és dins [start_date, end_date] i té el flag
+    del dia de la setmana a 1 (calendar.txt), afegint les excepcions de tipus 1 i
+    traient les de tipus 2 (calendar_dates.txt).
+    """
+    flags = cal[DIES_SETMANA].fillna(0).to_numpy(dtype=bool)        # (serveis, 7)
+    dies_np = dies.to_numpy()
+    actiu = (flags[:, dies.dayofweek.to_numpy()]
+             & (cal['start_date'].to_numpy()[:, None] <= dies_np[None, :])
+             & (cal['end_date'].to_numpy()[:, None] >= dies_np[None, :]))
+    idx_servei, idx_dia = np.nonzero(actiu)
+    base = pd.DataFrame({
+        'service_id': cal['service_id'].to_numpy()[idx_servei],
+        'dia': dies_np[idx_dia],
+    })
+
+    excepcions = cal_d[cal_d['date'].isin(dies)].rename(columns={'date': 'dia'})
+    afegits = excepcions.loc[excepcions['exception_type'] == 1, ['service_id', 'dia']]
+    trets = excepcions.loc[excepcions['exception_type'] == 2, ['service_id', 'dia']]
+
+    actius = pd.concat([base, afegits], ignore_index=True).drop_duplicates()
+    actius = actius.merge(trets, on=['service_id', 'dia'], how='left', indicator=True)
+    return actius.loc[actius['_merge'] == 'left_only', ['service_id', 'dia']].reset_index(drop=True)
+
+
+def processar_dades_vectorial(
+        data_inici: str,
+        periode: int,
+        host: str = "192.168.1.251",
+        port: int = 5432,
+        dbname: str = "gisdb",
+        user: str = "atm",
+        password: str = "atm",
+        format: str = "ample",
+        regenera: bool = False
+    ) -> int:
+    """
+    Alternativa a processar_dades que projecta els serveis en Python, sense
+    cridar atm.projecta_serveis_route ruta a ruta.
+
+    Carrega cal, cal_d, tri i sto_t una sola vegada, expandeix cada viatge sobre
+    els seus dies de servei actius amb aritmètica de dates vectoritzada (incloent
+    hores GTFS posteriors a les 24:00) i escriu el resultat a serveis_projectats
+    amb COPY, un bloc per dia de servei.
+
+    Es projecten els passos amb temps_ts dins [data_inici, data_inici + periode).
+    També es té en compte el dia de servei anterior per incloure els viatges que
+    continuen després de mitjanit.
+
+    Fa servir la mateixa taula de checkpoints que el motor sql
+    (serveis_projectats_ckpt), però amb motor='vectorial', perquè les dues
+    finestres no coincideixen: se salten les rutes COMPLETAT del període, i de
+    les INICIAT se n'esborren primer les files del període. Totes les rutes es
+    projecten en una sola transacció, que també les marca com a COMPLETAT.
+
+    Amb format='compacte' s'escriu a serveis_projectats_c només temps_int, el dia
+    de servei i les claus enteres del viatge i la parada (taules sp_viatges i
+    sp_parades); la vista v_serveis_projectats_c en recupera la resta de columnes
+    de les taules de claus, que s'actualitzen abans de projectar. Els viatges que
+    han canviat al GTFS reben una trip_key nova, de manera que els dies ja
+    projectats conserven els atributs amb què es van projectar.
+
+    Args:
+        data_inici: Data d'inici en format 'YYYY/MM/DD'
+        periode: Període en hores a processar
+        host: Host de la base de dades
+        port: Port de la base de dades
+        dbname: Nom de la base de dades
+        user: Usuari de la base de dades
+        password: Contrasenya de la base de dades
+        format: 'ample' (serveis_projectats) o 'compacte' (serveis_projectats_c)
+        regenera: Elimina primer les particions i els checkpoints del període a la taula del format
+
+    Returns:
+        int: Nombre de registres inserits
+    """
+    inici = pd.Timestamp(datetime.strptime(data_inici, "%Y/%m/%d"))
+    fi = inici + pd.Timedelta(hours=periode)
+    data_fi = fi.strftime("%Y/%m/%d")
+    epoch = pd.Timestamp("1970-01-01")
+    t_inici = int((inici - epoch).total_seconds())
+    t_fi = int((fi - epoch).total_seconds())
+    dies = pd.date_range(inici - pd.Timedelta(days=1), (fi - pd.Timedelta(seconds=1)).normalize(), freq='D')
+
+    if format not in ("ample", "compacte"):
+        raise ValueError(f"Format desconegut: {format}")
+    compacte = format == "compacte"
+    taula = "serveis_projectats_c" if compacte else "serveis_projectats"
+
+    conn = crea_conn_postgis(host, port, dbname, user, password)
+    try:
+        if regenera:
+            print(f"Eliminant les particions de {taula} de {len(dies) - 1} dies a partir de {data_inici}...")
+            elimina_particions(conn, data_inici, len(dies) - 1, taula)
+        crea_particions(conn, data_inici, len(dies) - 1, taula)
+
+        start = time.perf_counter()
+        print("Carregant calendari, viatges i horaris...")
+
+        cal = pd.read_sql_query(
+            "SELECT service_id::text AS service_id, monday, tuesday, wednesday, thursday, friday, saturday, sunday,"
+            " to_date(start_date::text, 'YYYYMMDD') AS start_date, to_date(end_date::text, 'YYYYMMDD') AS end_date"
+            " FROM atm.cal", conn)
+        cal['start_date'] = pd.to_datetime(cal['start_date'])
+        cal['end_date'] = pd.to_datetime(cal['end_date'])
+
+        cal_d = pd.read_sql_query(
+            "SELECT service_id::text AS service_id, to_date(date::text, 'YYYYMMDD') AS date, exception_type"
+            " FROM atm.cal_d", conn)
+        cal_d['date'] = pd.to_datetime(cal_d['date'])
+
+        actius = dies_servei_actius(cal, cal_d, dies)
+        serveis = actius['service_id'].unique().tolist()
+
+        sto_t = pd.read_sql_query(
+            "SELECT st.trip_id::text AS trip_id, t.route_id::text AS route_id, t.service_id::text AS service_id,"
+            " st.stop_id::text AS stop_id, st.stop_sequence, st.arrival_time, st.departure_time,"
+            " st.shape_dist_traveled"
+            " FROM atm.sto_t st JOIN atm.tri t ON t.trip_id = st.trip_id"
+            " WHERE t.service_id::text = ANY(%s)", conn, params=(serveis,))
+
+        # Rutes ja projectades en una execució anterior del mateix període amb aquest motor
+        checkpoints = llegeix_checkpoints(conn, data_inici, data_fi, taula, motor="vectorial")
+        completades = [ruta for ruta, estat in checkpoints.items() if estat == 'COMPLETAT']
+        if completades:
+            print(f"Se salten {len(completades)} rutes ja projectades en una execució anterior")
+            sto_t = sto_t[~sto_t['route_id'].isin(completades)]
+        rutes = sorted(sto_t['route_id'].dropna().unique().tolist())
+        parcials = [ruta for ruta in rutes if checkpoints.get(ruta) == 'INICIAT']
+        if not rutes:
+            print("No queden rutes per projectar en aquest període")
+            return 0
+
+        if compacte:
+            # Claus enteres dels viatges i parades (s'afegeixen les dels identificadors nous i
+            # les versions noves dels viatges); de cada viatge es fa servir la versió del GTFS actual
+            cur = conn.cursor()
+            cur.execute("SELECT atm.actualitza_claus_serveis_projectats();")
+            cur.close()
+            claus_viatges = pd.read_sql_query("SELECT trip_id, trip_key FROM atm.sp_viatges_actuals",
+                                              conn).set_index('trip_id')['trip_key']
+            claus_parades = pd.read_sql_query("SELECT stop_id, stop_key FROM atm.sp_parades",
+                                              conn).set_index('stop_id')['stop_key']
+            sto_t['trip_key'] = sto_t['trip_id'].map(claus_viatges)
+            sto_t['stop_key'] = sto_t['stop_id'].map(claus_parades)
+
+            # Les columnes de claus de serveis_projectats_c són NOT NULL: es comprova abans d'escriure
+            sense_clau = sto_t['trip_key'].isna() | sto_t['stop_key'].isna()
+            if sense_clau.any():
+                exemples = sto_t.loc[sense_clau, ['trip_id', 'stop_id']].drop_duplicates().head(5)
+                raise ValueError(f"{int(sense_clau.sum())} horaris sense clau a sp_viatges/sp_parades "
+                                 f"(p.ex. {exemples.to_dict('records')})")
+            sto_t['trip_key'] = sto_t['trip_key'].astype(np.int64)
+            sto_t['stop_key'] = sto_t['stop_key'].astype(np.int64)
+        else:
+            sto = pd.read_sql_query("SELECT stop_id::text AS stop_id, stop_code::text AS stop_code,"
+                                    " geom::text AS geom FROM atm.sto", conn).set_index('stop_id')
+
+        for columna in ('trip_id', 'route_id', 'service_id', 'stop_id'):
+            sto_t[columna] = sto_t[columna].astype('category')
+
+        # Hora de pas (sortida, o arribada si no n'hi ha) en segons des de l'inici del dia
+        segons = segons_gtfs(sto_t['departure_time']).fillna(segons_gtfs(sto_t['arrival_time']))
+        sto_t = sto_t.loc[segons.notna()].copy()
+        sto_t['segons'] = segons[segons.notna()].astype(np.int64)
+        sto_t['shape_dist_traveled'] = sto_t['shape_dist_traveled'].round().astype('Int64')
+
+        atributs_servei = cal.set_index('service_id')
+        print(f"Carregats {len(sto_t)} horaris de {len(serveis)} serveis actius "
+              f"({timedelta(seconds=time.perf_counter() - start)})")
+
+        columnes = COLUMNES_COMPACTES if compacte else COLUMNES_PROJECCIO
+        copy_sql = (f"COPY atm.{taula} ({', '.join(columnes)}) "
+                    f"FROM STDIN WITH (FORMAT csv)")
+        total_files = 0
+
+        # Marca INICIAT fora de la transacció (com projecta_ruta), perquè quedi constància si el procés mor
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT INTO atm.serveis_projectats_ckpt (taula, motor, route_id, data_inici, data_fi, estat)\
+                SELECT %s, 'vectorial', unnest(%s::text[]), to_date(%s, 'YYYY/MM/DD'), to_date(%s, 'YYYY/MM/DD'), 'INICIAT'\
+            ON CONFLICT (taula, motor, route_id, data_inici, data_fi)\
+                DO UPDATE SET estat = 'INICIAT', inici_ts = now(), fi_ts = NULL;",
+            (taula, rutes, data_inici, data_fi,)
+        )
+
+        conn.autocommit = False
+        try:
+            # Files de les rutes que havien quedat a mitges en aquest període
+            if parcials and compacte:
+                cur.execute(
+                    "DELETE FROM atm.serveis_projectats_c c\
+                        USING atm.sp_viatges v JOIN atm.sp_rutes r ON r.route_key = v.route_key\
+                        WHERE v.trip_key = c.trip_key AND r.route_id = ANY(%s)\
+                        AND c.temps_int >= %s AND c.temps_int < %s;",
+                    (parcials, t_inici, t_fi,)
+                )
+            elif parcials:
+                cur.execute(
+                    "DELETE FROM atm.serveis_projectats\
+                        WHERE route_id = ANY(%s) AND temps_int >= %s AND temps_int < %s;",
+                    (parcials, t_inici, t_fi,)
+                )
+            if parcials:
+                print(f"Esborrades {cur.rowcount} files de {len(parcials)} rutes a mitges")
+
+            for idx, dia in enumerate(dies, start=1):
+                serveis_dia = actius.loc[actius['dia'] == dia, 'service_id']
+                passos = sto_t[sto_t['service_id'].isin(serveis_dia)]
+
+                temps_int = int((dia - epoch).total_seconds()) + passos['segons']
+                dins = (temps_int >= t_inici) & (temps_int < t_fi)
+                passos = passos[dins]
+                temps_int = temps_int[dins]
+
+                if len(passos) and compacte:
+                    bloc = pd.DataFrame({
+                        'temps_int': temps_int.to_numpy(),
+                        'dia': dia,
+                        'trip_key': passos['trip_key'].to_numpy(),
+                        'stop_key': passos['stop_key'].to_numpy(),
+                        'stop_sequence': passos['stop_sequence'].to_numpy(),
+                    }, columns=COLUMNES_COMPACTES)
+                elif len(passos):
+                    servei = atributs_servei.reindex(passos['service_id'].astype(str))
+                    bloc = pd.DataFrame({
+                        'temps_ts': dia + pd.to_timedelta(passos['segons'].to_numpy(), unit='s'),
+                        'dia': dia,
+                        'dow': (dia.dayofweek + 1) % 7,  # 0 = diumenge, com EXTRACT(dow)
+                        **{d: servei[d].astype('Int64').to_numpy() for d in DIES_SETMANA},
+                        'service_id': passos['service_id'].to_numpy(),
+                        'start_date': servei['start_date'].dt.date.to_numpy(),
+                        'end_date': servei['end_date'].dt.date.to_numpy(),
+                        'trip_id': passos['trip_id'].to_numpy(),
+                        'route_id': passos['route_id'].to_numpy(),
+                        'stop_id': passos['stop_id'].to_numpy(),
+                        'stop_sequence': passos['stop_sequence'].to_numpy(),
+                        'arrival_time': passos['arrival_time'].to_numpy(),
+                        'departure_time': passos['departure_time'].to_numpy(),
+                        'shape_dist_traveled': passos['shape_dist_traveled'].to_numpy(),
+                        'stop_code': passos['stop_id'].map(sto['stop_code']).to_numpy(),
+                        'geom': passos['stop_id'].map(sto['geom']).to_numpy(),
+                        'temps_int': temps_int.to_numpy(),
+                    }, columns=COLUMNES_PROJECCIO)
+
+                if len(passos):
+                    buffer = io.StringIO()
+                    bloc.to_csv(buffer, header=False, index=False, date_format='%Y-%m-%d %H:%M:%S')
+                    buffer.seek(0)
+                    cur.copy_expert(copy_sql, buffer)
+                    total_files += len(bloc)
+
+                # Càlcul d'ETA
+                elapsed = time.perf_counter() - start
+                eta_secs = int(elapsed / idx * (len(dies) - idx))
+                print(f"DIA: {dia:%d/%m/%Y} ->[{idx}/{len(dies)}] registres: {len(passos)} "
+                      f"ETA: {timedelta(seconds=eta_secs)}")
+
+            cur.execute(
+                "UPDATE atm.serveis_projectats_ckpt SET estat = 'COMPLETAT', fi_ts = now()\
+                    WHERE taula = %s AND motor = 'vectorial' AND route_id = ANY(%s)\
+                    AND data_inici = to_date(%s, 'YYYY/MM/DD') AND data_fi = to_date(%s, 'YYYY/MM/DD');",
+                (taula, rutes, data_inici, data_fi,)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+        elapsed = time.perf_counter() - start
+        print(f"Total registres projectats: {total_files}")
+        print(f"Temps total de procés: {timedelta(seconds=elapsed)}")
+        return total_files
+
     finally:
-        cur1.close()
+        conn.close()
 
 
 if __name__ == "__main__":
-    # Exemple: processar 12 períodes de 5 minuts a partir del 04/05/2025
-    res = processar_dades(data_inici="2025/10/20", periode=24*10)
+    # Exemple: processar 10 dies a partir del 20/10/2025
+    parser = argparse.ArgumentParser(description="Projecta els serveis GTFS al temps")
+    parser.add_argument("--data-inici", default="2025/10/20", help="Data d'inici (YYYY/MM/DD)")
+    parser.add_argument("--periode", type=int, default=24*10, help="Període en hores")
+    parser.add_argument("--workers", type=int, default=1, help="Rutes projectades en paral·lel")
+    parser.add_argument("--motor", choices=["sql", "vectorial"], default="sql",
+                        help="sql: atm.projecta_serveis_route per ruta; vectorial: projecció en Python")
+    parser.add_argument("--format", choices=["ample", "compacte"], default="ample",
+                        help="ample: serveis_projectats; compacte: serveis_projectats_c (motor vectorial)")
+    parser.add_argument("--regenera", action="store_true",
+                        help="Elimina les particions del període abans de projectar")
+    args = parser.parse_args()
+
+    if args.motor == "vectorial":
+        res = processar_dades_vectorial(data_inici=args.data_inici, periode=args.periode,
+                                        format=args.format, regenera=args.regenera)
+    else:
+        res = processar_dades(data_inici=args.data_inici, periode=args.periode,
+                              workers=args.workers, regenera=args.regenera)
 
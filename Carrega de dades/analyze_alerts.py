@@ -2,45 +2,125 @@
 # -*- coding: utf-8 -*-
 """
 Script d'exemple per analitzar les dades d'alertes ATM descarregades
+
+El fitxer (CSV separat per ';' o Parquet) es llegeix per blocs de files i
+només es guarden els recomptes parcials, de manera que la memòria no depèn
+de la mida de l'històric.
 """
 
 import pandas as pd
 from collections import Counter
+import argparse
+import os
 import sys
 
-def analyze_alerts(csv_file):
-    """Analitza el fitxer CSV d'alertes"""
+# Columnes que fa servir l'anàlisi (la resta del fitxer no es llegeix)
+COLUMNS = [
+    'download_timestamp', 'alert_id', 'effect', 'active_start', 'active_end',
+    'description_cat', 'affected_routes', 'affected_stops'
+]
+
+def iter_chunks(data_file, chunksize=100000):
+    """Llegeix el fitxer d'alertes per blocs de `chunksize` files (CSV amb ';' o Parquet)"""
+    if data_file.lower().endswith('.parquet'):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Cal el paquet pyarrow per llegir fitxers Parquet")
+        
+        parquet_file = pq.ParquetFile(data_file)
+        columns = [c for c in COLUMNS if c in parquet_file.schema_arrow.names]
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(data_file, sep=';', usecols=lambda c: c in COLUMNS,
+                               dtype=str, chunksize=chunksize)
+
+def count_items(series):
+    """Recompte dels elements d'una columna de llistes separades per ';'"""
+    items = series.dropna().str.split(';').explode()
+    items = items[items.notna() & (items != '')]
+    return items.value_counts()
+
+def summarize_alerts(data_file, chunksize=100000):
+    """
+    Calcula els recomptes de l'anàlisi bloc a bloc i els acumula.
+    
+    Returns:
+        dict: total de registres, alertes úniques, període, efectes, rutes i
+        parades (Counter), total d'alertes actives i les 5 primeres
+    """
+    summary = {
+        'total': 0,
+        'alert_ids': set(),
+        'first_download': None,
+        'min_download': None,
+        'max_download': None,
+        'effects': Counter(),
+        'routes': Counter(),
+        'stops': Counter(),
+        'active_total': 0,
+        'active_sample': [],
+    }
+    
+    for chunk in iter_chunks(data_file, chunksize):
+        if chunk.empty:
+            continue
+        
+        summary['total'] += len(chunk)
+        summary['alert_ids'].update(chunk['alert_id'].dropna().unique())
+        
+        downloads = chunk['download_timestamp'].dropna()
+        if not downloads.empty:
+            if summary['first_download'] is None:
+                summary['first_download'] = downloads.iloc[0]
+            chunk_min, chunk_max = downloads.min(), downloads.max()
+            if summary['min_download'] is None or chunk_min < summary['min_download']:
+                summary['min_download'] = chunk_min
+            if summary['max_download'] is None or chunk_max > summary['max_download']:
+                summary['max_download'] = chunk_max
+        
+        summary['effects'].update(chunk['effect'].value_counts().to_dict())
+        summary['routes'].update(count_items(chunk['affected_routes']).to_dict())
+        summary['stops'].update(count_items(chunk['affected_stops']).to_dict())
+        
+        # Alertes actives (sense data de finalització)
+        active = chunk[chunk['active_end'].isna() | (chunk['active_end'] == '')]
+        summary['active_total'] += len(active)
+        if len(summary['active_sample']) < 5:
+            missing = 5 - len(summary['active_sample'])
+            summary['active_sample'].extend(active.head(missing).to_dict('records'))
+    
+    return summary
+
+def analyze_alerts(data_file, chunksize=100000):
+    """Analitza el fitxer d'alertes (CSV o Parquet)"""
     
     try:
         # Carregar dades
-        print(f"Carregant dades de: {csv_file}")
-        df = pd.read_csv(csv_file, sep=';')
-        print(f"Total registres carregats: {len(df)}")
+        print(f"Analitzant dades de: {data_file} (blocs de {chunksize} files)")
+        summary = summarize_alerts(data_file, chunksize)
+        print(f"Total registres carregats: {summary['total']}")
         print()
         
         # Estadístiques bàsiques
         print("=== ESTADÍSTIQUES BÀSIQUES ===")
-        print(f"Total alertes: {len(df)}")
-        print(f"Alertes úniques: {df['alert_id'].nunique()}")
-        print(f"Periode de dades: {df['download_timestamp'].min()} - {df['download_timestamp'].max()}")
+        print(f"Total alertes: {summary['total']}")
+        print(f"Alertes úniques: {len(summary['alert_ids'])}")
+        print(f"Periode de dades: {summary['min_download']} - {summary['max_download']}")
         print()
         
         # Tipus d'efectes
         print("=== TIPUS D'EFECTES ===")
-        effects = df['effect'].value_counts()
-        for effect, count in effects.items():
+        effects = summary['effects'].most_common()
+        for effect, count in effects:
             print(f"{effect}: {count}")
         print()
         
         # Rutes més afectades
         print("=== RUTES MÉS AFECTADES ===")
-        all_routes = []
-        for routes in df['affected_routes'].dropna():
-            if routes:  # Si no està buit
-                all_routes.extend(routes.split(';'))
-        
-        if all_routes:
-            most_affected_routes = Counter(all_routes).most_common(10)
+        most_affected_routes = summary['routes'].most_common(10)
+        if most_affected_routes:
             for route, count in most_affected_routes:
                 print(f"{route}: {count} alertes")
         else:
@@ -49,13 +129,8 @@ def analyze_alerts(csv_file):
         
         # Parades més afectades
         print("=== PARADES MÉS AFECTADES ===")
-        all_stops = []
-        for stops in df['affected_stops'].dropna():
-            if stops:  # Si no està buit
-                all_stops.extend(stops.split(';'))
-        
-        if all_stops:
-            most_affected_stops = Counter(all_stops).most_common(10)
+        most_affected_stops = summary['stops'].most_common(10)
+        if most_affected_stops:
             for stop, count in most_affected_stops:
                 print(f"{stop}: {count} alertes")
         else:
@@ -63,39 +138,38 @@ def analyze_alerts(csv_file):
         print()
         
         # Alertes actives (sense data de finalització)
-        active_alerts = df[df['active_end'].isna() | (df['active_end'] == '')]
         print(f"=== ALERTES ACTIVES ===")
-        print(f"Total alertes actives: {len(active_alerts)}")
+        print(f"Total alertes actives: {summary['active_total']}")
         
-        if len(active_alerts) > 0:
+        if summary['active_total'] > 0:
             print("\nPrimeres 5 alertes actives:")
-            for idx, row in active_alerts.head().iterrows():
+            for row in summary['active_sample']:
+                desc = row['description_cat'] if isinstance(row['description_cat'], str) else ''
                 print(f"- ID: {row['alert_id']}")
                 print(f"  Efecte: {row['effect']}")
-                print(f"  Descripció: {row['description_cat'][:100]}...")
+                print(f"  Descripció: {desc[:100]}...")
                 print(f"  Inici: {row['active_start']}")
                 print()
         
         # Exportar resum
-        summary_file = csv_file.replace('.csv', '_summary.txt')
+        summary_file = os.path.splitext(data_file)[0] + '_summary.txt'
         with open(summary_file, 'w', encoding='utf-8') as f:
-            f.write(f"RESUM D'ALERTES ATM - {df['download_timestamp'].iloc[0]}\n")
+            f.write(f"RESUM D'ALERTES ATM - {summary['first_download']}\n")
             f.write("=" * 50 + "\n\n")
-            f.write(f"Total alertes: {len(df)}\n")
-            f.write(f"Alertes úniques: {df['alert_id'].nunique()}\n")
-            f.write(f"Alertes actives: {len(active_alerts)}\n\n")
+            f.write(f"Total alertes: {summary['total']}\n")
+            f.write(f"Alertes úniques: {len(summary['alert_ids'])}\n")
+            f.write(f"Alertes actives: {summary['active_total']}\n\n")
             
             f.write("Tipus d'efectes:\n")
-            for effect, count in effects.items():
+            for effect, count in effects:
                 f.write(f"  {effect}: {count}\n")
             
             f.write("\nRutes més afectades:\n")
-            if all_routes:
-                for route, count in Counter(all_routes).most_common(10):
-                    f.write(f"  {route}: {count}\n")
+            for route, count in most_affected_routes:
+                f.write(f"  {route}: {count}\n")
         
         print(f"Resum guardat a: {summary_file}")
-        
+    
     except Exception as e:
         print(f"Error en analitzar les dades: {e}")
         return False
@@ -104,18 +178,19 @@ def analyze_alerts(csv_file):
 
 def main():
     """Funció principal"""
-    if len(sys.argv) != 2:
-        print("Ús: python analyze_alerts.py <fitxer_csv>")
-        print("Exemple: python analyze_alerts.py test_alerts.csv")
-        sys.exit(1)
-    
-    csv_file = sys.argv[1]
+    parser = argparse.ArgumentParser(
+        description="Analitza un fitxer d'alertes ATM (CSV separat per ';' o Parquet)",
+        epilog="Exemple: python analyze_alerts.py test_alerts.csv")
+    parser.add_argument("fitxer", help="Fitxer .csv o .parquet amb les alertes")
+    parser.add_argument("--chunksize", type=int, default=100000,
+                        help="Files llegides per bloc (limita la memòria utilitzada)")
+    args = parser.parse_args()
     
     print("=" * 60)
     print("ANÀLISI D'ALERTES ATM")
     print("=" * 60)
     
-    success = analyze_alerts(csv_file)
+    success = analyze_alerts(args.fitxer, args.chunksize)
     
     if not success:
         sys.exit(1)
@@ -125,4 +200,4 @@ def main():
     print("=" * 60)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -6,8 +6,10 @@ Script d'exemple per analitzar les dades d'alertes ATM des de la base de dades P
 
 import psycopg2
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
-import pandas as pd
-from collections import Counter
+import argparse
+import codecs
+import json
+import os
 import sys
 from datetime import datetime
 
@@ -27,8 +29,97 @@ def connect_db(host="192.168.1.251", port=5432, dbname="gisdb", user="atm", pass
         print(f"Error en connectar a la base de dades: {e}")
         return None
 
-def analyze_alerts_from_db():
-    """Analitza les alertes des de la base de dades"""
+# Esquema per defecte de les taules i vistes d'alertes (download_alerts_Genera BD.sql)
+# i de les taules del procés GTFS que s'exporten
+DEFAULT_SCHEMA = 'atm'
+
+# Consultes de l'informe ({schema}: esquema de les alertes): cada una retorna
+# només el resultat final agregat. Tots els recomptes es llegeixen de les taules
+# de resum que manté download_alerts.py, així l'informe no recorre l'històric
+REPORT_QUERIES = {
+    'basic': """
+        SELECT COALESCE(SUM(total_alerts), 0),
+               (SELECT COUNT(*) FROM {schema}.alert_id_summary),
+               MIN(first_seen), MAX(last_seen)
+        FROM {schema}.alerts_summary_stats
+    """,
+    'latest_downloads': """
+        SELECT download_timestamp, total_alerts
+        FROM {schema}.alert_download_summary
+        ORDER BY download_timestamp DESC
+        LIMIT 5
+    """,
+    'effects': """
+        SELECT effect, SUM(total_alerts)
+        FROM {schema}.alerts_summary_stats
+        GROUP BY effect
+        HAVING SUM(total_alerts) > 0
+        ORDER BY SUM(total_alerts) DESC, effect
+    """,
+    'top_routes': """
+        SELECT route_id, SUM(total_alerts) AS alertes
+        FROM {schema}.alert_route_summary
+        WHERE route_id <> ''
+        GROUP BY route_id
+        ORDER BY alertes DESC, route_id
+        LIMIT %(top_n)s
+    """,
+    'top_stops': """
+        SELECT stop_id, SUM(total_alerts) AS alertes
+        FROM {schema}.alert_stop_summary
+        WHERE stop_id <> ''
+        GROUP BY stop_id
+        ORDER BY alertes DESC, stop_id
+        LIMIT %(top_n)s
+    """,
+    'active_count': """
+        SELECT COUNT(*)
+        FROM {schema}.alerts_active_summary
+    """,
+    'active_sample': """
+        SELECT alert_id, effect, description_cat, active_start
+        FROM {schema}.alerts_active_summary
+        ORDER BY active_start DESC NULLS LAST
+        LIMIT 5
+    """,
+    'effect_stats': """
+        SELECT effect,
+               SUM(total_alerts) AS total_alerts,
+               SUM(total_alerts) FILTER (WHERE status IN ('ACTIVE', 'ACTIVE_OLD')) AS active_alerts
+        FROM {schema}.alerts_summary_stats
+        GROUP BY effect
+        HAVING SUM(total_alerts) > 0
+        ORDER BY effect
+    """,
+    'daily': """
+        SELECT 
+            dia,
+            SUM(total_alerts) as total_alertes,
+            COUNT(*) as alertes_uniques
+        FROM {schema}.alert_daily_summary
+        WHERE dia >= DATE(NOW() - INTERVAL '7 days')
+        GROUP BY dia
+        ORDER BY dia DESC
+    """,
+}
+
+def fetch_report(conn, top_n=10, schema=DEFAULT_SCHEMA):
+    """Executa les consultes de l'informe i en retorna els resultats (llistes de tuples)"""
+    report = {}
+    with conn.cursor() as cursor:
+        for name, sql in REPORT_QUERIES.items():
+            cursor.execute(sql.format(schema=schema), {'top_n': top_n})
+            report[name] = cursor.fetchall()
+    return report
+
+def analyze_alerts_from_db(top_n=10, schema=DEFAULT_SCHEMA):
+    """
+    Analitza les alertes des de la base de dades.
+
+    Els recomptes es fan al servidor (REPORT_QUERIES) i només es transfereixen
+    els resultats finals, de manera que el temps de l'informe no depèn de
+    carregar tot l'històric d'alertes.
+    """
     
     conn = connect_db()
     if not conn:
@@ -42,51 +133,37 @@ def analyze_alerts_from_db():
         print(f"Data d'anàlisi: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         print()
         
-        # Carregar dades des de la vista completa
-        print("Carregant dades des de la base de dades...")
-        df = pd.read_sql_query("""
-            SELECT * FROM atm_sc.v_alerts_complete 
-            ORDER BY download_timestamp DESC
-        """, conn)
+        print("Calculant l'informe a la base de dades...")
+        report = fetch_report(conn, top_n, schema)
         
-        if df.empty:
+        total, unique_alerts, first_download, last_download = report['basic'][0]
+        if total == 0:
             print("No s'han trobat alertes a la base de dades")
             return True
         
-        print(f"Total registres carregats: {len(df)}")
-        print()
-        
         # Estadístiques bàsiques
         print("=== ESTADÍSTIQUES BÀSIQUES ===")
-        print(f"Total alertes: {len(df)}")
-        print(f"Alertes úniques: {df['alert_id'].nunique()}")
-        print(f"Període de dades: {df['download_timestamp'].min()} - {df['download_timestamp'].max()}")
+        print(f"Total alertes: {total}")
+        print(f"Alertes úniques: {unique_alerts}")
+        print(f"Període de dades: {first_download} - {last_download}")
         print()
         
         # Últimes descàrregues
         print("=== ÚLTIMES DESCÀRREGUES ===")
-        latest_downloads = df['download_timestamp'].value_counts().head(5)
-        for timestamp, count in latest_downloads.items():
+        for timestamp, count in report['latest_downloads']:
             print(f"{timestamp}: {count} alertes")
         print()
         
         # Tipus d'efectes
         print("=== TIPUS D'EFECTES ===")
-        effects = df['effect'].value_counts()
-        for effect, count in effects.items():
+        for effect, count in report['effects']:
             print(f"{effect}: {count}")
         print()
         
         # Rutes més afectades
         print("=== RUTES MÉS AFECTADES ===")
-        all_routes = []
-        for routes in df['affected_routes'].dropna():
-            if routes and routes.strip():
-                all_routes.extend([r.strip() for r in routes.split(';') if r.strip()])
-        
-        if all_routes:
-            most_affected_routes = Counter(all_routes).most_common(10)
-            for route, count in most_affected_routes:
+        if report['top_routes']:
+            for route, count in report['top_routes']:
                 print(f"{route}: {count} alertes")
         else:
             print("No s'han trobat rutes afectades")
@@ -94,78 +171,59 @@ def analyze_alerts_from_db():
         
         # Parades més afectades
         print("=== PARADES MÉS AFECTADES ===")
-        all_stops = []
-        for stops in df['affected_stops'].dropna():
-            if stops and stops.strip():
-                all_stops.extend([s.strip() for s in stops.split(';') if s.strip()])
-        
-        if all_stops:
-            most_affected_stops = Counter(all_stops).most_common(10)
-            for stop, count in most_affected_stops:
+        if report['top_stops']:
+            for stop, count in report['top_stops']:
                 print(f"{stop}: {count} alertes")
         else:
             print("No s'han trobat parades afectades")
         print()
         
-        # Alertes actives (des de la vista d'actives)
-        active_df = pd.read_sql_query("SELECT * FROM atm_sc.v_alerts_active", conn)
+        # Alertes actives
+        active_count = report['active_count'][0][0]
         print(f"=== ALERTES ACTIVES ===")
-        print(f"Total alertes actives: {len(active_df)}")
+        print(f"Total alertes actives: {active_count}")
         
-        if len(active_df) > 0:
+        if active_count > 0:
             print("\nPrimeres 5 alertes actives:")
-            for idx, row in active_df.head().iterrows():
-                print(f"- ID: {row['alert_id']}")
-                print(f"  Efecte: {row['effect']}")
-                desc = row['description_cat'] or ''
+            for alert_id, effect, description, active_start in report['active_sample']:
+                print(f"- ID: {alert_id}")
+                print(f"  Efecte: {effect}")
+                desc = description or ''
                 print(f"  Descripció: {desc[:100]}{'...' if len(desc) > 100 else ''}")
-                print(f"  Inici: {row['active_start']}")
+                print(f"  Inici: {active_start}")
                 print()
         
-        # Estadístiques per efecte (des de la vista d'estadístiques)
+        # Estadístiques per efecte
         print("=== ESTADÍSTIQUES PER EFECTE ===")
-        stats_df = pd.read_sql_query("SELECT * FROM atm_sc.v_alerts_stats", conn)
-        for idx, row in stats_df.iterrows():
-            print(f"{row['effect']}: {row['total_alerts']} total, {row['active_alerts']} actives")
+        for effect, total_alerts, active_alerts in report['effect_stats']:
+            print(f"{effect}: {total_alerts} total, {active_alerts} actives")
         print()
         
         # Evolució temporal
         print("=== EVOLUCIÓ TEMPORAL (ÚLTIMS DIES) ===")
-        temporal_df = pd.read_sql_query("""
-            SELECT 
-                DATE(download_timestamp) as dia,
-                COUNT(*) as total_alertes,
-                COUNT(DISTINCT alert_id) as alertes_uniques
-            FROM atm_sc.alerts 
-            WHERE download_timestamp >= NOW() - INTERVAL '7 days'
-            GROUP BY DATE(download_timestamp)
-            ORDER BY dia DESC
-        """, conn)
-        
-        for idx, row in temporal_df.iterrows():
-            print(f"{row['dia']}: {row['total_alertes']} alertes ({row['alertes_uniques']} úniques)")
+        for dia, total_alertes, alertes_uniques in report['daily']:
+            print(f"{dia}: {total_alertes} alertes ({alertes_uniques} úniques)")
         
         # Exportar resum
         summary_file = f"alerts_summary_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
         with open(summary_file, 'w', encoding='utf-8') as f:
             f.write(f"RESUM D'ALERTES ATM - BD - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
             f.write("=" * 60 + "\n\n")
-            f.write(f"Total alertes a la BD: {len(df)}\n")
-            f.write(f"Alertes úniques: {df['alert_id'].nunique()}\n")
-            f.write(f"Alertes actives: {len(active_df)}\n\n")
+            f.write(f"Total alertes a la BD: {total}\n")
+            f.write(f"Alertes úniques: {unique_alerts}\n")
+            f.write(f"Alertes actives: {active_count}\n\n")
             
             f.write("Tipus d'efectes:\n")
-            for effect, count in effects.items():
+            for effect, count in report['effects']:
                 f.write(f"  {effect}: {count}\n")
             
             f.write("\nRutes més afectades:\n")
-            if all_routes:
-                for route, count in Counter(all_routes).most_common(10):
-                    f.write(f"  {route}: {count}\n")
+            for route, count in report['top_routes']:
+                f.write(f"  {route}: {count}\n")
             
             f.write("\nEstadístiques per efecte:\n")
-            for idx, row in stats_df.iterrows():
-                f.write(f"  {row['effect']}: {row['total_alerts']} total, {row['active_alerts']} actives\n")
+            for effect, total_alerts, active_alerts in report['effect_stats']:
+                f.write(f"  {effect}: {total_alerts} total, {active_alerts} actives\n")
         
         print(f"\nResum guardat a: {summary_file}")
         
@@ -177,27 +235,226 @@ def analyze_alerts_from_db():
     
     return True
 
-def export_to_csv():
-    """Exporta les dades de la BD a CSV per compatibilitat"""
+# Exportacions disponibles ({schema}: esquema de les taules). Les que tenen
+# incremental_column es poden exportar en mode incremental: només les files
+# posteriors a la darrera exportació. La marca és el màxim d'incremental_column a
+# watermark_table i es guarda a EXPORT_STATE_FILE, al directori de sortida
+EXPORTS = {
+    'alerts': {
+        'query': "SELECT * FROM {schema}.v_alerts_complete",
+        'prefix': 'atm_alerts_from_db',
+        'incremental_column': 'download_timestamp',
+        'watermark_table': '{schema}.alerts',
+    },
+    'alerts_active': {
+        'query': "SELECT * FROM {schema}.v_alerts_active",
+        'prefix': 'atm_alerts_active',
+    },
+    'sto_puntuades': {
+        'query': "SELECT * FROM {schema}.sto_puntuades",
+        'prefix': 'sto_puntuades',
+    },
+    'serveis_projectats': {
+        'query': "SELECT * FROM {schema}.serveis_projectats",
+        'prefix': 'serveis_projectats',
+    },
+}
+
+EXPORT_STATE_FILE = 'export_state.json'
+
+EXPORT_FORMATS = ('csv', 'parquet', 'arrow')
+
+# Compressions que admet el format Arrow IPC (Parquet admet també snappy, gzip...)
+ARROW_IPC_COMPRESSIONS = ('zstd', 'lz4')
+
+# Tipus que el cursor d'exportació retorna com a text (sense crear objectes Python
+# per valor) i que es converteixen a Arrow de manera vectorial: date, timestamp,
+# timestamptz i numeric
+TEXT_PARSED_OIDS = (1082, 1114, 1184, 1700)
+
+def _arrow_columns(description):
+    """
+    Esquema Arrow a partir de cursor.description (OID dels tipus de PostgreSQL).
+    Retorna (esquema, conversors); els tipus no previstos (geometria...) es
+    guarden com a text.
+    """
+    import pyarrow as pa
+    
+    types = {
+        16: pa.bool_(),
+        20: pa.int64(),
+        21: pa.int16(),
+        23: pa.int32(),
+        700: pa.float32(),
+        701: pa.float64(),
+        1700: pa.float64(),
+        1082: pa.date32(),
+        1114: pa.timestamp('us'),
+        1184: pa.timestamp('us', tz='UTC'),
+        1005: pa.list_(pa.int16()),
+        1007: pa.list_(pa.int32()),
+        1016: pa.list_(pa.int64()),
+        1009: pa.list_(pa.string()),
+    }
+    fields = []
+    converters = []
+    for column in description:
+        arrow_type = types.get(column.type_code, pa.string())
+        fields.append(pa.field(column.name, arrow_type))
+        if column.type_code in TEXT_PARSED_OIDS:
+            converters.append(lambda values, t=arrow_type: pa.array(values, type=pa.string()).cast(t))
+        elif column.type_code not in types:
+            converters.append(lambda values: pa.array([None if v is None else str(v) for v in values],
+                                                      type=pa.string()))
+        else:
+            converters.append(lambda values, t=arrow_type: pa.array(values, type=t))
+    return pa.schema(fields), converters
+
+def _export_csv(conn, query, path):
+    """Escriu el resultat de la consulta amb COPY TO STDOUT directament al fitxer"""
+    with open(path, 'wb') as f:
+        # Mateix format que l'exportació amb pandas: utf-8 amb BOM i separador ';'
+        f.write(codecs.BOM_UTF8)
+        with conn.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER, DELIMITER ';')", f)
+            return cursor.rowcount
+
+def _export_arrow(conn, query, path, fmt, compression, batch_size):
+    """Escriu el resultat de la consulta en Parquet o Arrow IPC, per blocs de batch_size files"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Cal el paquet pyarrow per exportar en format Parquet o Arrow")
+    
+    # Els cursors de servidor necessiten una transacció
+    conn.autocommit = False
+    writer = None
+    rows = 0
+    try:
+        with conn.cursor(name='export_cursor') as cursor:
+            cursor.itersize = batch_size
+            psycopg2.extensions.register_type(
+                psycopg2.extensions.new_type(TEXT_PARSED_OIDS, 'EXPORT_TEXT', lambda value, cur: value),
+                cursor)
+            cursor.execute(query)
+            while True:
+                batch = cursor.fetchmany(batch_size)
+                if writer is None:
+                    schema, converters = _arrow_columns(cursor.description)
+                    if fmt == 'parquet':
+                        writer = pq.ParquetWriter(path, schema, compression=compression)
+                    else:
+                        writer = pa.ipc.new_file(path, schema,
+                                                 options=pa.ipc.IpcWriteOptions(compression=compression))
+                if not batch:
+                    break
+                
+                arrays = [converter(values) for values, converter in zip(zip(*batch), converters)]
+                writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+                rows += len(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+        conn.rollback()
+        conn.autocommit = True
+    return rows
+
+def export_query(conn, name, fmt='csv', output_dir='.', since=None, compression='zstd', batch_size=50000,
+                 schema=DEFAULT_SCHEMA):
+    """
+    Exporta una de les consultes d'EXPORTS al directori output_dir.
+
+    El resultat es llegeix en streaming (COPY TO STDOUT per al CSV, cursor de
+    servidor per a Parquet/Arrow), de manera que la memòria no depèn del
+    nombre de files. Amb `since` només s'exporten les files amb
+    incremental_column posterior a aquesta marca.
+
+    Returns:
+        tuple: (fitxer, files exportades, nova marca); fitxer és None si en mode
+        incremental no hi ha files noves
+    """
+    spec = EXPORTS[name]
+    query = spec['query'].format(schema=schema)
+    watermark = None
+    
+    column = spec.get('incremental_column')
+    if column:
+        watermark_table = spec['watermark_table'].format(schema=schema)
+        # Límit superior fix: les files inserides durant l'exportació van a la següent
+        with conn.cursor() as cursor:
+            if since is None:
+                cursor.execute(f"SELECT MAX({column}) FROM {watermark_table}")
+            else:
+                cursor.execute(f"SELECT MAX({column}) FROM {watermark_table}"
+                               f" WHERE {column} > %s::timestamptz", (since,))
+            watermark = cursor.fetchone()[0]
+            if watermark is None:
+                if since is not None:
+                    return None, 0, since
+            elif since is None:
+                query = cursor.mogrify(f"SELECT * FROM ({query}) q WHERE {column} <= %s",
+                                       (watermark,)).decode()
+            else:
+                query = cursor.mogrify(f"SELECT * FROM ({query}) q"
+                                       f" WHERE {column} > %s::timestamptz AND {column} <= %s",
+                                       (since, watermark)).decode()
+    
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    path = os.path.join(output_dir, f"{spec['prefix']}_{timestamp}.{fmt}")
+    if fmt == 'csv':
+        rows = _export_csv(conn, query, path)
+    else:
+        rows = _export_arrow(conn, query, path, fmt, compression, batch_size)
+    
+    return path, rows, watermark.isoformat() if watermark is not None else since
+
+def export_data(names=('alerts', 'alerts_active'), fmt='csv', incremental=False,
+                output_dir='.', compression='zstd', batch_size=50000, schema=DEFAULT_SCHEMA):
+    """
+    Exporta les consultes `names` d'EXPORTS en format csv, parquet o arrow.
+
+    Amb incremental=True les exportacions que ho permeten només inclouen les
+    files posteriors a la darrera exportació guardada a EXPORT_STATE_FILE.
+    """
+    if fmt == 'arrow' and compression not in ARROW_IPC_COMPRESSIONS:
+        print(f"Arrow IPC no admet la compressió {compression}, s'utilitza zstd")
+        compression = 'zstd'
+    
     conn = connect_db()
     if not conn:
         return False
+    conn.set_client_encoding('UTF8')
+    # Les dates i timestamps es llegeixen com a text (TEXT_PARSED_OIDS): format ISO
+    # i en UTC, independentment de la configuració del servidor
+    with conn.cursor() as cursor:
+        cursor.execute("SET DateStyle = 'ISO'; SET TimeZone = 'UTC'")
+    
+    state_path = os.path.join(output_dir, EXPORT_STATE_FILE)
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path, encoding='utf-8') as f:
+            state = json.load(f)
     
     try:
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        
-        # Exportar alertes completes
-        print("Exportant alertes a CSV...")
-        df = pd.read_sql_query("SELECT * FROM atm_sc.v_alerts_complete", conn)
-        csv_filename = f"atm_alerts_from_db_{timestamp}.csv"
-        df.to_csv(csv_filename, index=False, encoding='utf-8-sig', sep=';')
-        print(f"Alertes exportades a: {csv_filename}")
-        
-        # Exportar només alertes actives
-        active_df = pd.read_sql_query("SELECT * FROM atm_sc.v_alerts_active", conn)
-        active_csv = f"atm_alerts_active_{timestamp}.csv"
-        active_df.to_csv(active_csv, index=False, encoding='utf-8-sig', sep=';')
-        print(f"Alertes actives exportades a: {active_csv}")
+        os.makedirs(output_dir, exist_ok=True)
+        for name in names:
+            since = state.get(name) if incremental else None
+            print(f"Exportant {name} ({fmt}{', des de ' + since if since else ''})...")
+            start = datetime.now()
+            path, rows, watermark = export_query(conn, name, fmt, output_dir, since,
+                                                 compression, batch_size, schema)
+            if path is None:
+                print(f"Cap fila nova a {name} des de la darrera exportació")
+                continue
+            
+            elapsed = (datetime.now() - start).total_seconds()
+            print(f"{rows} files exportades a: {path} ({elapsed:.1f} s)")
+            if watermark is not None:
+                state[name] = watermark
+                with open(state_path, 'w', encoding='utf-8') as f:
+                    json.dump(state, f, indent=2)
         
         return True
         
@@ -207,27 +464,49 @@ def export_to_csv():
     finally:
         conn.close()
 
+def export_to_csv():
+    """Exporta les alertes i les alertes actives de la BD a CSV per compatibilitat"""
+    return export_data(['alerts', 'alerts_active'], fmt='csv')
+
 def main():
     """Funció principal"""
+    parser = argparse.ArgumentParser(description="Anàlisi i exportació d'alertes ATM des de la BD")
+    parser.add_argument("opcio", nargs="?", choices=["1", "2", "3"],
+                        help="1: anàlisi, 2: exportació, 3: tots dos")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv", help="Format de l'exportació")
+    parser.add_argument("--taules", default="alerts,alerts_active",
+                        help=f"Exportacions separades per comes ({', '.join(EXPORTS)})")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Exporta només les files noves des de la darrera exportació")
+    parser.add_argument("--directori", default=".", help="Directori dels fitxers exportats")
+    parser.add_argument("--esquema", default=DEFAULT_SCHEMA,
+                        help="Esquema de les taules i vistes d'alertes (p. ex. atm_sc)")
+    parser.add_argument("--compressio", default="zstd",
+                        help="Compressió de Parquet (zstd, lz4, snappy...) o Arrow (zstd, lz4)")
+    args = parser.parse_args()
+    
     print("Script d'anàlisi d'alertes ATM - Base de Dades")
     print("Opcions disponibles:")
     print("1. Anàlisi complet")
-    print("2. Exportar a CSV")
+    print("2. Exportar")
     print("3. Tots dos")
     
-    if len(sys.argv) > 1:
-        option = sys.argv[1]
+    if args.opcio:
+        option = args.opcio
     else:
         option = input("\nTrieu una opció (1-3) [1]: ").strip() or "1"
     
     success = True
     
     if option in ["1", "3"]:
-        success &= analyze_alerts_from_db()
+        success &= analyze_alerts_from_db(schema=args.esquema)
     
     if option in ["2", "3"]:
         print("\n" + "=" * 60)
-        success &= export_to_csv()
+        success &= export_data([t.strip() for t in args.taules.split(',') if t.strip()],
+                               fmt=args.format, incremental=args.incremental,
+                               output_dir=args.directori, compression=args.compressio,
+                               schema=args.esquema)
     
     print("\n" + "=" * 60)
     if success:
@@ -10,12 +10,35 @@ Data: Octubre 2025
 
 import requests
 import json
+import hashlib
 import psycopg2
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from psycopg2.extras import execute_values
 import pandas as pd
 from datetime import datetime, timedelta, timezone
 import sys
 import time
+import random
+import argparse
+
+# Dependència opcional: gtfs-realtime-bindings permet llegir el feed en format protobuf
+try:
+    from google.transit import gtfs_realtime_pb2
+except ImportError:
+    gtfs_realtime_pb2 = None
+
+class AlertRecord:
+    """Registre d'una alerta per a la BD (un per entitat i període actiu)"""
+    __slots__ = (
+        'api_timestamp', 'gtfs_version', 'incrementality', 'alert_id',
+        'effect', 'active_start', 'active_end', 'status', 'header_cat', 'header_es',
+        'header_en', 'description_cat', 'description_es', 'description_en',
+        'url_cat', 'url_es', 'url_en', 'routes', 'stops', 'content_hash'
+    )
+    
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
 
 class ATMAlertDownloader:
     """Classe per descarregar i processar alertes de l'API ATM i guardar-les a PostgreSQL"""
@@ -25,11 +48,12 @@ class ATMAlertDownloader:
                  port: int = 5432,
                  dbname: str = "gisdb", 
                  user: str = "atm",
-                 password: str = "atm"):
+                 password: str = "atm",
+                 api_url: str = "https://t-mobilitat.atm.cat/opendata/alerts/json/user/token/open"):
         """
         Inicialitza el downloader amb la configuració de la BD
         """
-        self.api_url = "https://t-mobilitat.atm.cat/opendata/alerts/json/user/token/open"
+        self.api_url = api_url
         self.db_config = {
             'host': host,
             'port': port,
@@ -39,6 +63,13 @@ class ATMAlertDownloader:
         }
         self.conn = None
         
+        # Estat del mode resident (run_poller): sessió HTTP persistent i
+        # validadors de la darrera resposta per fer peticions condicionals
+        self.session = None
+        self.etag = None
+        self.last_modified = None
+        self.last_feed_hash = None
+        
     def calculate_status(self, active_start, active_end):
         """
         Calcula l'status de l'alerta segons els criteris:
@@ -63,9 +94,114 @@ class ATMAlertDownloader:
         else:
             return 'ACTIVE'
         
+    # Mateixos criteris que calculate_status, aplicats a la BD en una sola sentència:
+    # només s'actualitzen les alertes (i les seves rutes i parades) que canvien de status
+    REFRESH_STATUSES_SQL = """
+        WITH new_status AS (
+            SELECT id,
+                   status AS old_status,
+                   CASE
+                       WHEN active_end IS NOT NULL AND active_end <= now() THEN 'CLOSED'
+                       WHEN active_end IS NULL AND active_start IS NOT NULL
+                            AND active_start < now() - interval '7 days' THEN 'ACTIVE_OLD'
+                       ELSE 'ACTIVE'
+                   END AS status
+            FROM atm.alerts
+            WHERE status IS DISTINCT FROM 'CLOSED'
+        ),
+        changed_alerts AS (
+            UPDATE atm.alerts a
+            SET status = n.status
+            FROM new_status n
+            WHERE a.id = n.id
+              AND a.status IS DISTINCT FROM n.status
+            RETURNING a.id, a.status, n.old_status, a.effect, a.active_start,
+                      a.download_timestamp, COALESCE(a.last_seen, a.download_timestamp) AS last_seen
+        ),
+        changed_routes AS (
+            UPDATE atm.alert_routes ar
+            SET status = c.status
+            FROM changed_alerts c
+            WHERE ar.alert_table_id = c.id
+              AND ar.status IS DISTINCT FROM c.status
+            RETURNING ar.id
+        ),
+        changed_stops AS (
+            UPDATE atm.alert_stops ast
+            SET status = c.status
+            FROM changed_alerts c
+            WHERE ast.alert_table_id = c.id
+              AND ast.status IS DISTINCT FROM c.status
+            RETURNING ast.id
+        ),
+        -- Taules de resum: cada alerta canviada passa del status antic al nou
+        moves AS (
+            SELECT id, status, 1 AS delta, active_start, download_timestamp, last_seen
+            FROM changed_alerts
+            UNION ALL
+            SELECT id, COALESCE(old_status, ''), -1, NULL, NULL, NULL
+            FROM changed_alerts
+        ),
+        summary_stats AS (
+            INSERT INTO atm.alerts_summary_stats AS s (effect, status, total_alerts, first_seen, last_seen)
+            SELECT COALESCE(c.effect, ''), m.status, SUM(m.delta), MIN(m.download_timestamp), MAX(m.last_seen)
+            FROM moves m
+            JOIN changed_alerts c ON c.id = m.id
+            GROUP BY 1, 2
+            ON CONFLICT (effect, status) DO UPDATE
+            SET total_alerts = s.total_alerts + EXCLUDED.total_alerts,
+                first_seen = LEAST(s.first_seen, EXCLUDED.first_seen),
+                last_seen = GREATEST(s.last_seen, EXCLUDED.last_seen)
+        ),
+        summary_routes AS (
+            INSERT INTO atm.alert_route_summary AS s (route_id, status, total_alerts, first_alert, last_alert)
+            SELECT r.route_id, m.status, SUM(m.delta), MIN(m.active_start), MAX(m.active_start)
+            FROM (SELECT DISTINCT alert_table_id, route_id
+                  FROM atm.alert_routes
+                  WHERE alert_table_id IN (SELECT id FROM changed_alerts)) r
+            JOIN moves m ON m.id = r.alert_table_id
+            GROUP BY 1, 2
+            ON CONFLICT (route_id, status) DO UPDATE
+            SET total_alerts = s.total_alerts + EXCLUDED.total_alerts,
+                first_alert = LEAST(s.first_alert, EXCLUDED.first_alert),
+                last_alert = GREATEST(s.last_alert, EXCLUDED.last_alert)
+        ),
+        summary_stops AS (
+            INSERT INTO atm.alert_stop_summary AS s (stop_id, status, total_alerts, first_alert, last_alert)
+            SELECT st.stop_id, m.status, SUM(m.delta), MIN(m.active_start), MAX(m.active_start)
+            FROM (SELECT DISTINCT alert_table_id, stop_id
+                  FROM atm.alert_stops
+                  WHERE alert_table_id IN (SELECT id FROM changed_alerts)) st
+            JOIN moves m ON m.id = st.alert_table_id
+            GROUP BY 1, 2
+            ON CONFLICT (stop_id, status) DO UPDATE
+            SET total_alerts = s.total_alerts + EXCLUDED.total_alerts,
+                first_alert = LEAST(s.first_alert, EXCLUDED.first_alert),
+                last_alert = GREATEST(s.last_alert, EXCLUDED.last_alert)
+        ),
+        active_closed AS (
+            DELETE FROM atm.alerts_active_summary s
+            USING changed_alerts c
+            WHERE s.id = c.id
+              AND c.status NOT IN ('ACTIVE', 'ACTIVE_OLD')
+        ),
+        active_changed AS (
+            UPDATE atm.alerts_active_summary s
+            SET status = c.status,
+                updated_at = NOW()
+            FROM changed_alerts c
+            WHERE s.id = c.id
+              AND c.status IN ('ACTIVE', 'ACTIVE_OLD')
+        )
+        SELECT (SELECT count(*) FROM changed_alerts),
+               (SELECT count(*) FROM changed_routes),
+               (SELECT count(*) FROM changed_stops);
+    """
+
     def update_existing_statuses(self):
         """
-        Actualitza el status de totes les alertes existents a la BD
+        Actualitza el status de les alertes existents a la BD (excepte les CLOSED,
+        que ja no canvien) i el propaga a les seves rutes i parades
         """
         if not self.conn:
             print("Error: No hi ha connexió a la base de dades")
@@ -73,45 +209,11 @@ class ATMAlertDownloader:
         
         try:
             cursor = self.conn.cursor()
+            cursor.execute(self.REFRESH_STATUSES_SQL)
+            alerts_count, routes_count, stops_count = cursor.fetchone()
             
-            # Obtenir totes les alertes existents
-            cursor.execute("""
-                SELECT id, active_start, active_end 
-                FROM atm.alerts 
-                WHERE status != 'CLOSED' OR status IS NULL
-            """)
-            
-            alerts_to_update = cursor.fetchall()
-            updated_count = 0
-            
-            for alert_id, active_start, active_end in alerts_to_update:
-                # Calcular nou status
-                new_status = self.calculate_status(active_start, active_end)
-                
-                # Actualitzar alerta principal
-                cursor.execute("""
-                    UPDATE atm.alerts 
-                    SET status = %s 
-                    WHERE id = %s
-                """, (new_status, alert_id))
-                
-                # Actualitzar rutes relacionades
-                cursor.execute("""
-                    UPDATE atm.alert_routes 
-                    SET status = %s 
-                    WHERE alert_table_id = %s
-                """, (new_status, alert_id))
-                
-                # Actualitzar parades relacionades
-                cursor.execute("""
-                    UPDATE atm.alert_stops 
-                    SET status = %s 
-                    WHERE alert_table_id = %s
-                """, (new_status, alert_id))
-                
-                updated_count += 1
-            
-            print(f"Actualitzats {updated_count} registres d'alertes amb nous status")
+            print(f"Actualitzats {alerts_count} registres d'alertes amb nous status "
+                  f"({routes_count} rutes, {stops_count} parades)")
             return True
             
         except psycopg2.Error as e:
@@ -137,164 +239,344 @@ class ATMAlertDownloader:
             print("Connexió a la base de dades tancada")
         
     def download_data(self):
-        """Descarrega les dades de l'API"""
+        """Descarrega el feed de l'API (JSON o protobuf) i en retorna el contingut sense processar"""
         try:
             print(f"Descarregant dades de: {self.api_url}")
-            response = requests.get(self.api_url, timeout=30)
+            response = (self.session or requests).get(self.api_url, timeout=30)
             response.raise_for_status()
             
-            data = response.json()
-            print(f"Dades descarregades correctament. Timestamp: {data.get('header', {}).get('timestamp', 'N/A')}")
-            return data
+            print(f"Dades descarregades correctament ({len(response.content)} bytes)")
+            return response.content
             
         except requests.exceptions.RequestException as e:
             print(f"Error en descarregar les dades: {e}")
             return None
-        except json.JSONDecodeError as e:
-            print(f"Error en processar el JSON: {e}")
+    
+    def download_if_changed(self):
+        """
+        Descàrrega condicional per al mode resident.
+
+        Envia If-None-Match / If-Modified-Since amb els validadors de la darrera
+        resposta i compara el hash del contingut amb el de l'anterior, sense
+        llegir el feed. Retorna (contingut, canviat): contingut és None si hi ha
+        hagut un error i canviat és False si el feed és el mateix que a la
+        consulta anterior.
+        """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        
+        try:
+            response = self.session.get(self.api_url, headers=headers, timeout=30)
+            if response.status_code == 304:
+                print("Feed sense canvis (304 Not Modified)")
+                return b'', False
+            response.raise_for_status()
+            content = response.content
+            
+        except requests.exceptions.RequestException as e:
+            print(f"Error en descarregar les dades: {e}")
+            return None, False
+        
+        self.etag = response.headers.get('ETag')
+        self.last_modified = response.headers.get('Last-Modified')
+        
+        feed_hash = hashlib.sha256(content).hexdigest()
+        if feed_hash == self.last_feed_hash:
+            print("Feed sense canvis (mateix contingut)")
+            return content, False
+        self.last_feed_hash = feed_hash
+        
+        print(f"Dades descarregades correctament ({len(content)} bytes)")
+        return content, True
+    
+    def forget_validators(self):
+        """Oblida els validadors perquè la consulta següent torni a baixar i processar el feed"""
+        self.etag = self.last_modified = self.last_feed_hash = None
+    
+    @staticmethod
+    def to_datetime(timestamp):
+        """Converteix un timestamp UNIX a data (None si no n'hi ha o no és vàlid)"""
+        if not timestamp:
+            return None
+        try:
+            return datetime.fromtimestamp(timestamp)
+        except (TypeError, ValueError, OverflowError, OSError):
             return None
     
-    def process_alerts(self, data):
-        """Processa les alertes i les converteix en una llista de diccionaris per a la BD"""
-        if not data or 'entity' not in data:
-            print("No hi ha dades d'alertes per processar")
-            return []
+    def iter_feed(self, data):
+        """
+        Llegeix el feed d'alertes entitat a entitat.
+
+        Accepta el JSON ja carregat (dict), el contingut JSON (bytes o str) o el
+        protobuf binari de GTFS-Realtime. La resposta ja és sencera en memòria,
+        així que el JSON es carrega d'una sola passada amb json.loads. El primer element és la capçalera del
+        feed (dict); la resta, una tupla per alerta amb les traduccions ja
+        resoltes: (alert_id, effect, períodes, capçaleres, descripcions, urls,
+        rutes, parades).
+        """
+        if isinstance(data, dict):
+            yield data.get('header', {})
+            for entity in data.get('entity', []):
+                yield self._json_entity(entity)
+            return
         
-        alerts_list = []
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if not data.lstrip(b'\xef\xbb\xbf \t\r\n').startswith(b'{'):
+            yield from self._protobuf_feed(data)
+        else:
+            yield from self.iter_feed(json.loads(data))
+    
+    @staticmethod
+    def _json_translations(translated):
+        """{idioma: text} d'un camp de text traduït del JSON"""
+        if not translated:
+            return {}
+        return {t.get('language', ''): t.get('text', '') for t in translated.get('translation', [])}
+    
+    def _json_entity(self, entity):
+        alert = entity.get('alert', {})
+        informed_entities = alert.get('informed_entity', [])
+        # Si no hi ha períodes actius, se'n crea un amb valors buits
+        periods = [(period.get('start'), period.get('end'))
+                   for period in alert.get('active_period', [])] or [(None, None)]
+        return (
+            entity.get('id', ''),
+            alert.get('effect', ''),
+            periods,
+            self._json_translations(alert.get('header_text')),
+            self._json_translations(alert.get('description_text')),
+            self._json_translations(alert.get('url')),
+            tuple(e['route_id'] for e in informed_entities if 'route_id' in e),
+            tuple(e['stop_id'] for e in informed_entities if 'stop_id' in e)
+        )
+    
+    def _protobuf_feed(self, data):
+        """Llegeix el feed en format protobuf de GTFS-Realtime"""
+        if gtfs_realtime_pb2 is None:
+            raise ImportError("Cal el paquet gtfs-realtime-bindings per llegir el feed en format protobuf")
         
-        # Informació del header
-        header_info = data.get('header', {})
-        gtfs_version = header_info.get('gtfs_realtime_version', '')
-        incrementality = header_info.get('incrementality', '')
-        timestamp = header_info.get('timestamp', '')
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.ParseFromString(bytes(data))
         
-        # Convertir timestamp UNIX a data llegible
-        api_timestamp = None
-        if timestamp:
-            try:
-                api_timestamp = datetime.fromtimestamp(timestamp)
-            except:
-                api_timestamp = None
+        header = feed.header
+        yield {
+            'gtfs_realtime_version': header.gtfs_realtime_version,
+            'incrementality': gtfs_realtime_pb2.FeedHeader.Incrementality.Name(header.incrementality),
+            'timestamp': header.timestamp if header.HasField('timestamp') else None
+        }
+        
+        effect_name = gtfs_realtime_pb2.Alert.Effect.Name
+        for entity in feed.entity:
+            if not entity.HasField('alert'):
+                continue
+            alert = entity.alert
+            periods = [(period.start if period.HasField('start') else None,
+                        period.end if period.HasField('end') else None)
+                       for period in alert.active_period] or [(None, None)]
+            yield (
+                entity.id,
+                effect_name(alert.effect) if alert.HasField('effect') else '',
+                periods,
+                {t.language: t.text for t in alert.header_text.translation},
+                {t.language: t.text for t in alert.description_text.translation},
+                {t.language: t.text for t in alert.url.translation},
+                tuple(e.route_id for e in alert.informed_entity if e.HasField('route_id')),
+                tuple(e.stop_id for e in alert.informed_entity if e.HasField('stop_id'))
+            )
+    
+    def process_alerts(self, data):
+        """
+        Processa les alertes del feed (vegeu iter_feed) i les converteix en una
+        llista d'AlertRecord per a la BD, un per alerta i període actiu.
+        Retorna None si el feed no es pot llegir (per distingir-ho d'un feed buit)
+        """
+        if not data:
+            print("No hi ha dades d'alertes per processar")
+            return None
         
-        for entity in data.get('entity', []):
-            alert = entity.get('alert', {})
-            alert_id = entity.get('id', '')
+        alerts_list = []
+        try:
+            feed = self.iter_feed(data)
             
-            # Informació dels períodes actius
-            active_periods = alert.get('active_period', [])
-            if not active_periods:
-                # Si no hi ha períodes actius, crear un amb valors buits
-                active_periods = [{}]
+            # Informació del header
+            header_info = next(feed, {})
+            gtfs_version = header_info.get('gtfs_realtime_version', '')
+            incrementality = header_info.get('incrementality', '')
+            api_timestamp = self.to_datetime(header_info.get('timestamp'))
             
-            for period in active_periods:
-                start_time = period.get('start', '')
-                end_time = period.get('end', '')
-                
-                # Convertir timestamps a dates
-                active_start = None
-                active_end = None
-                
-                if start_time:
-                    try:
-                        active_start = datetime.fromtimestamp(start_time)
-                    except:
-                        active_start = None
-                
-                if end_time:
-                    try:
-                        active_end = datetime.fromtimestamp(end_time)
-                    except:
-                        active_end = None
-                
-                # Efecte de l'alerta
-                effect = alert.get('effect', '')
-                
-                # Textos de descripció i capçalera
-                description_texts = alert.get('description_text', {}).get('translation', [])
-                header_texts = alert.get('header_text', {}).get('translation', [])
-                
-                # Extreure texts per idioma
-                desc_cat = desc_es = desc_en = ''
-                header_cat = header_es = header_en = ''
-                
-                for desc in description_texts:
-                    lang = desc.get('language', '')
-                    text = desc.get('text', '')
-                    if lang == 'cat':
-                        desc_cat = text
-                    elif lang == 'es':
-                        desc_es = text
-                    elif lang == 'en':
-                        desc_en = text
-                
-                for header in header_texts:
-                    lang = header.get('language', '')
-                    text = header.get('text', '')
-                    if lang == 'cat':
-                        header_cat = text
-                    elif lang == 'es':
-                        header_es = text
-                    elif lang == 'en':
-                        header_en = text
+            for alert_id, effect, periods, headers, descriptions, urls, routes, stops in feed:
+                header_cat = headers.get('cat', '')
+                header_es = headers.get('es', '')
+                header_en = headers.get('en', '')
+                desc_cat = descriptions.get('cat', '')
+                desc_es = descriptions.get('es', '')
+                desc_en = descriptions.get('en', '')
+                url_cat = urls.get('cat', '')
+                url_es = urls.get('es', '')
+                url_en = urls.get('en', '')
                 
-                # Entitats informades (rutes i parades afectades)
-                informed_entities = alert.get('informed_entity', [])
-                routes = []
-                stops = []
-                
-                for entity_info in informed_entities:
-                    if 'route_id' in entity_info:
-                        routes.append(entity_info['route_id'])
-                    if 'stop_id' in entity_info:
-                        stops.append(entity_info['stop_id'])
-                
-                # URLs
-                url_translations = alert.get('url', {}).get('translation', [])
-                url_cat = url_es = url_en = ''
-                
-                for url in url_translations:
-                    lang = url.get('language', '')
-                    text = url.get('text', '')
-                    if lang == 'cat':
-                        url_cat = text
-                    elif lang == 'es':
-                        url_es = text
-                    elif lang == 'en':
-                        url_en = text
-                
-                # Calcular status de l'alerta
-                status = self.calculate_status(active_start, active_end)
-                
-                # Crear registre per a la BD
-                alert_record = {
-                    'api_timestamp': api_timestamp,
-                    'gtfs_version': gtfs_version,
-                    'incrementality': incrementality,
-                    'alert_id': alert_id,
-                    'effect': effect,
-                    'active_start': active_start,
-                    'active_end': active_end,
-                    'status': status,
-                    'header_cat': header_cat,
-                    'header_es': header_es,
-                    'header_en': header_en,
-                    'description_cat': desc_cat,
-                    'description_es': desc_es,
-                    'description_en': desc_en,
-                    'url_cat': url_cat,
-                    'url_es': url_es,
-                    'url_en': url_en,
-                    'routes': routes,
-                    'stops': stops
-                }
-                
-                alerts_list.append(alert_record)
+                for start_time, end_time in periods:
+                    active_start = self.to_datetime(start_time)
+                    active_end = self.to_datetime(end_time)
+                    
+                    alert_record = AlertRecord(
+                        api_timestamp, gtfs_version, incrementality, alert_id,
+                        effect, active_start, active_end,
+                        self.calculate_status(active_start, active_end),
+                        header_cat, header_es, header_en, desc_cat, desc_es, desc_en,
+                        url_cat, url_es, url_en, routes, stops
+                    )
+                    alert_record.content_hash = self.content_hash(alert_record)
+                    alerts_list.append(alert_record)
+                    
+        except Exception as e:
+            print(f"Error en processar el feed d'alertes: {e}")
+            return None
         
         print(f"Processades {len(alerts_list)} alertes")
         return alerts_list
     
+    # Interval mínim entre dues actualitzacions de last_seen d'una mateixa alerta
+    LAST_SEEN_INTERVAL = '15 minutes'
+
+    # Columnes d'atm.alerts que omple save_to_database, en l'ordre dels registres
+    ALERT_COLUMNS = (
+        'api_timestamp', 'gtfs_version', 'incrementality', 'alert_id',
+        'effect', 'active_start', 'active_end', 'status', 'header_cat', 'header_es',
+        'header_en', 'description_cat', 'description_es', 'description_en',
+        'url_cat', 'url_es', 'url_en', 'content_hash'
+    )
+
+    # Camps que defineixen el contingut d'una alerta (un període actiu); si no
+    # canvien entre descàrregues, l'alerta es considera la mateixa versió
+    CONTENT_HASH_COLUMNS = (
+        'effect', 'active_start', 'active_end', 'header_cat', 'header_es',
+        'header_en', 'description_cat', 'description_es', 'description_en',
+        'url_cat', 'url_es', 'url_en'
+    )
+
+    def content_hash(self, alert_record):
+        """Hash SHA-256 del contingut d'un registre d'alerta (textos, període i entitats informades)"""
+        content = [getattr(alert_record, column) for column in self.CONTENT_HASH_COLUMNS]
+        content.append(sorted(alert_record.routes))
+        content.append(sorted(alert_record.stops))
+        payload = json.dumps(content, default=str, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    # Actualitza les taules de resum amb les alertes inserides (new_ids) i les
+    # que s'han tornat a veure sense canvis (seen_ids) en una descàrrega
+    SUMMARY_INGEST_SQL = """
+        WITH new_alerts AS (
+            SELECT * FROM atm.alerts WHERE id = ANY(%(new_ids)s::int[])
+        ),
+        -- Un sol INSERT per taula: una mateixa fila no es pot modificar dues vegades
+        -- en una sentència, per això les alertes tornades a veure hi sumen 0 alertes
+        summary_stats AS (
+            INSERT INTO atm.alerts_summary_stats AS s (effect, status, total_alerts, first_seen, last_seen)
+            SELECT effect, status, SUM(n), MIN(first_seen), MAX(last_seen)
+            FROM (
+                SELECT COALESCE(effect, '') AS effect, COALESCE(status, '') AS status, 1 AS n,
+                       download_timestamp AS first_seen,
+                       COALESCE(last_seen, download_timestamp) AS last_seen
+                FROM new_alerts
+                UNION ALL
+                SELECT COALESCE(effect, ''), COALESCE(status, ''), 0, NULL, NOW()
+                FROM atm.alerts
+                WHERE id = ANY(%(seen_ids)s::int[])
+            ) g
+            GROUP BY effect, status
+            ON CONFLICT (effect, status) DO UPDATE
+            SET total_alerts = s.total_alerts + EXCLUDED.total_alerts,
+                first_seen = LEAST(s.first_seen, EXCLUDED.first_seen),
+                last_seen = GREATEST(s.last_seen, EXCLUDED.last_seen)
+        ),
+        summary_routes AS (
+            INSERT INTO atm.alert_route_summary AS s (route_id, status, total_alerts, first_alert, last_alert)
+            SELECT r.route_id, COALESCE(a.status, ''), COUNT(*), MIN(a.active_start), MAX(a.active_start)
+            FROM (SELECT DISTINCT alert_table_id, route_id
+                  FROM atm.alert_routes
+                  WHERE alert_table_id = ANY(%(new_ids)s::int[])) r
+            JOIN new_alerts a ON a.id = r.alert_table_id
+            GROUP BY 1, 2
+            ON CONFLICT (route_id, status) DO UPDATE
+            SET total_alerts = s.total_alerts + EXCLUDED.total_alerts,
+                first_alert = LEAST(s.first_alert, EXCLUDED.first_alert),
+                last_alert = GREATEST(s.last_alert, EXCLUDED.last_alert)
+        ),
+        summary_stops AS (
+            INSERT INTO atm.alert_stop_summary AS s (stop_id, status, total_alerts, first_alert, last_alert)
+            SELECT st.stop_id, COALESCE(a.status, ''), COUNT(*), MIN(a.active_start), MAX(a.active_start)
+            FROM (SELECT DISTINCT alert_table_id, stop_id
+                  FROM atm.alert_stops
+                  WHERE alert_table_id = ANY(%(new_ids)s::int[])) st
+            JOIN new_alerts a ON a.id = st.alert_table_id
+            GROUP BY 1, 2
+            ON CONFLICT (stop_id, status) DO UPDATE
+            SET total_alerts = s.total_alerts + EXCLUDED.total_alerts,
+                first_alert = LEAST(s.first_alert, EXCLUDED.first_alert),
+                last_alert = GREATEST(s.last_alert, EXCLUDED.last_alert)
+        ),
+        summary_downloads AS (
+            INSERT INTO atm.alert_download_summary AS s (download_timestamp, total_alerts)
+            SELECT download_timestamp, COUNT(*)
+            FROM new_alerts
+            GROUP BY 1
+            ON CONFLICT (download_timestamp) DO UPDATE
+            SET total_alerts = s.total_alerts + EXCLUDED.total_alerts
+        ),
+        summary_daily AS (
+            INSERT INTO atm.alert_daily_summary AS s (dia, alert_id, total_alerts)
+            SELECT DATE(download_timestamp), alert_id, COUNT(*)
+            FROM new_alerts
+            GROUP BY 1, 2
+            ON CONFLICT (dia, alert_id) DO UPDATE
+            SET total_alerts = s.total_alerts + EXCLUDED.total_alerts
+        ),
+        summary_ids AS (
+            INSERT INTO atm.alert_id_summary AS s (alert_id, total_alerts, first_download, last_download)
+            SELECT alert_id, COUNT(*), MIN(download_timestamp), MAX(download_timestamp)
+            FROM new_alerts
+            GROUP BY 1
+            ON CONFLICT (alert_id) DO UPDATE
+            SET total_alerts = s.total_alerts + EXCLUDED.total_alerts,
+                first_download = LEAST(s.first_download, EXCLUDED.first_download),
+                last_download = GREATEST(s.last_download, EXCLUDED.last_download)
+        ),
+        active_seen AS (
+            UPDATE atm.alerts_active_summary
+            SET last_seen = NOW(),
+                updated_at = NOW()
+            WHERE id = ANY(%(seen_ids)s::int[])
+        )
+        INSERT INTO atm.alerts_active_summary
+            (id, download_timestamp, api_timestamp, gtfs_version, incrementality, alert_id,
+             effect, active_start, active_end, status, header_cat, header_es, header_en,
+             description_cat, description_es, description_en, url_cat, url_es, url_en,
+             created_at, updated_at, affected_routes, affected_stops, content_hash, last_seen)
+        SELECT id, download_timestamp, api_timestamp, gtfs_version, incrementality, alert_id,
+               effect, active_start, active_end, status, header_cat, header_es, header_en,
+               description_cat, description_es, description_en, url_cat, url_es, url_en,
+               created_at, updated_at, affected_routes, affected_stops, content_hash, last_seen
+        FROM atm.v_alerts_complete
+        WHERE id = ANY(%(new_ids)s::int[])
+          AND status IN ('ACTIVE', 'ACTIVE_OLD');
+    """
+
     def save_to_database(self, alerts_list):
-        """Guarda les alertes a la base de dades PostgreSQL"""
+        """
+        Guarda les alertes a la base de dades PostgreSQL en una sola transacció.
+
+        Cada alerta porta el hash del seu contingut (content_hash). Les alertes
+        amb els mateixos hashos que la seva darrera versió guardada només
+        actualitzen last_seen; quan una alerta és nova o ha canviat s'insereix
+        una versió nova (tots els seus períodes, amb rutes i parades). Els id de les alertes noves es reserven
+        de la seqüència en una sola consulta i tot s'insereix en bloc. Les
+        taules de resum s'actualitzen a la mateixa transacció.
+        """
         if not alerts_list:
             print("No hi ha alertes per guardar")
             return False
@@ -303,75 +585,123 @@ class ATMAlertDownloader:
             print("Error: No hi ha connexió a la base de dades")
             return False
         
+        self.conn.autocommit = False
         try:
             cursor = self.conn.cursor()
-            saved_count = 0
             
+            # Treure les repetides dins la mateixa descàrrega i agrupar per alert_id
+            # (una alerta amb diversos períodes actius té un registre per període)
+            versions = {}
             for alert in alerts_list:
-                # Inserir alerta principal
-                insert_alert_sql = """
-                INSERT INTO atm.alerts (
-                    api_timestamp, gtfs_version, incrementality, alert_id, 
-                    effect, active_start, active_end, status, header_cat, header_es, 
-                    header_en, description_cat, description_es, description_en,
-                    url_cat, url_es, url_en
-                ) VALUES (
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-                ) 
-                ON CONFLICT (alert_id, download_timestamp) DO NOTHING
+                versions.setdefault(alert.alert_id, {}).setdefault(alert.content_hash, alert)
+            
+            # Darrera versió guardada de cada alerta: les files de la darrera
+            # descàrrega en què va canviar
+            cursor.execute("""
+                SELECT a.alert_id, a.content_hash, a.id
+                FROM atm.alerts a
+                JOIN (
+                    SELECT alert_id, MAX(download_timestamp) AS download_timestamp
+                    FROM atm.alerts
+                    WHERE alert_id = ANY(%s)
+                    GROUP BY alert_id
+                ) l ON l.alert_id = a.alert_id AND l.download_timestamp = a.download_timestamp
+                """, (list(versions),))
+            latest = {}
+            for alert_id, content_hash, alert_table_id in cursor.fetchall():
+                latest.setdefault(alert_id, {})[content_hash] = alert_table_id
+            
+            # Si els hashos coincideixen amb la darrera versió, l'alerta no ha canviat;
+            # si no, se n'insereix una versió nova amb tots els seus períodes (també
+            # quan torna a un contingut anterior, A -> B -> A)
+            seen = []
+            new_alerts = []
+            for alert_id, records in versions.items():
+                stored = latest.get(alert_id, {})
+                if stored.keys() == records.keys():
+                    seen.extend(stored.values())
+                else:
+                    new_alerts.extend(records.values())
+            
+            # Alertes sense canvis: només es marca que s'han tornat a veure, com a
+            # molt un cop cada LAST_SEEN_INTERVAL per no reescriure-les a cada consulta
+            seen_ids = []
+            if seen:
+                cursor.execute("""
+                    UPDATE atm.alerts
+                    SET last_seen = NOW()
+                    WHERE id = ANY(%s)
+                      AND (last_seen IS NULL OR last_seen < NOW() - %s::interval)
+                    RETURNING id
+                    """, (seen, self.LAST_SEEN_INTERVAL))
+                seen_ids = [row[0] for row in cursor.fetchall()]
+            
+            inserted = []
+            inserted_ids = set()
+            route_rows = []
+            stop_rows = []
+            if new_alerts:
+                # Reservar un id per alerta nova
+                cursor.execute(
+                    "SELECT nextval(pg_get_serial_sequence('atm.alerts', 'id')) FROM generate_series(1, %s)",
+                    (len(new_alerts),)
+                )
+                alert_table_ids = [row[0] for row in cursor.fetchall()]
+                
+                # Inserir alertes noves o modificades
+                insert_alert_sql = f"""
+                INSERT INTO atm.alerts (id, {', '.join(self.ALERT_COLUMNS)})
+                VALUES %s
                 RETURNING id;
                 """
+                inserted = execute_values(
+                    cursor, insert_alert_sql,
+                    [(alert_table_id, *(getattr(alert, column) for column in self.ALERT_COLUMNS))
+                     for alert_table_id, alert in zip(alert_table_ids, new_alerts)],
+                    page_size=1000, fetch=True
+                )
+                inserted_ids = {row[0] for row in inserted}
                 
-                cursor.execute(insert_alert_sql, (
-                    alert['api_timestamp'],
-                    alert['gtfs_version'],
-                    alert['incrementality'], 
-                    alert['alert_id'],
-                    alert['effect'],
-                    alert['active_start'],
-                    alert['active_end'],
-                    alert['status'],
-                    alert['header_cat'],
-                    alert['header_es'],
-                    alert['header_en'],
-                    alert['description_cat'],
-                    alert['description_es'],
-                    alert['description_en'],
-                    alert['url_cat'],
-                    alert['url_es'],
-                    alert['url_en']
-                ))
-                
-                result = cursor.fetchone()
-                if result:
-                    alert_table_id = result[0]
-                    saved_count += 1
-                    
-                    # Inserir rutes afectades
-                    for route_id in alert['routes']:
-                        insert_route_sql = """
-                        INSERT INTO atm.alert_routes (alert_table_id, alert_id, route_id, status)
-                        VALUES (%s, %s, %s, %s)
-                        """
-                        cursor.execute(insert_route_sql, (alert_table_id, alert['alert_id'], route_id, alert['status']))
-                    
-                    # Inserir parades afectades
-                    for stop_id in alert['stops']:
-                        insert_stop_sql = """
-                        INSERT INTO atm.alert_stops (alert_table_id, alert_id, stop_id, status)
-                        VALUES (%s, %s, %s, %s)
-                        """
-                        cursor.execute(insert_stop_sql, (alert_table_id, alert['alert_id'], stop_id, alert['status']))
+                for alert_table_id, alert in zip(alert_table_ids, new_alerts):
+                    route_rows.extend((alert_table_id, alert.alert_id, route_id, alert.status)
+                                      for route_id in alert.routes)
+                    stop_rows.extend((alert_table_id, alert.alert_id, stop_id, alert.status)
+                                     for stop_id in alert.stops)
+            
+            # Inserir rutes i parades afectades
+            if route_rows:
+                execute_values(cursor, """
+                    INSERT INTO atm.alert_routes (alert_table_id, alert_id, route_id, status)
+                    VALUES %s
+                    """, route_rows, page_size=1000)
+            if stop_rows:
+                execute_values(cursor, """
+                    INSERT INTO atm.alert_stops (alert_table_id, alert_id, stop_id, status)
+                    VALUES %s
+                    """, stop_rows, page_size=1000)
+            
+            # Taules de resum
+            cursor.execute(self.SUMMARY_INGEST_SQL, {
+                'new_ids': sorted(inserted_ids),
+                'seen_ids': seen_ids
+            })
+            
+            self.conn.commit()
             
             print(f"Alertes guardades correctament a la base de dades")
-            print(f"Total de registres nous: {saved_count}")
+            print(f"Total de registres nous o modificats: {len(inserted)}")
+            print(f"Total de registres sense canvis: {len(seen)}")
+            print(f"Total de rutes i parades afectades: {len(route_rows)} / {len(stop_rows)}")
             print(f"Total d'alertes processades: {len(alerts_list)}")
             
             return True
             
         except psycopg2.Error as e:
+            self.conn.rollback()
             print(f"Error en guardar les alertes a la base de dades: {e}")
             return False
+        finally:
+            self.conn.autocommit = True
     
     def run(self):
         """Executa tot el procés de descàrrega i guardatge a la BD"""
@@ -424,13 +754,108 @@ class ATMAlertDownloader:
         
         print("=" * 60)
         return True
+    
+    def poll_once(self):
+        """
+        Una consulta del mode resident: actualitza els status, descarrega el feed
+        si ha canviat i guarda les alertes. Retorna False si hi ha hagut un error.
+        """
+        if self.conn is None or self.conn.closed:
+            if not self.connect_db():
+                return False
+        
+        if not self.update_existing_statuses():
+            # Es torna a connectar a la consulta següent
+            self.disconnect_db()
+            return False
+        
+        data, changed = self.download_if_changed()
+        if data is None:
+            return False
+        if not changed:
+            return True
+        
+        alerts = self.process_alerts(data)
+        if alerts is None:
+            self.forget_validators()
+            return False
+        if alerts and not self.save_to_database(alerts):
+            self.forget_validators()
+            self.disconnect_db()
+            return False
+        return True
+    
+    def run_poller(self, interval=60, jitter=0.1, max_backoff=900, max_polls=None):
+        """
+        Mode resident: consulta l'API cada `interval` segons (±`jitter` relatiu)
+        mantenint la sessió HTTP i la connexió a la BD entre consultes. Els feeds
+        sense canvis (304, o mateix contingut) no es processen.
+        Després d'un error l'espera es dobla a cada error consecutiu fins a
+        `max_backoff` segons. S'atura amb Ctrl+C o després de `max_polls` consultes.
+        """
+        print("=" * 60)
+        print("DESCÀRREGA D'ALERTES ATM T-MOBILITAT (MODE RESIDENT)")
+        print("=" * 60)
+        print(f"Consultant {self.api_url} cada {interval} s")
+        
+        self.session = requests.Session()
+        polls = 0
+        errors = 0
+        try:
+            while True:
+                polls += 1
+                print()
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Consulta {polls}")
+                try:
+                    ok = self.poll_once()
+                except Exception as e:
+                    print(f"Error inesperat: {e}")
+                    self.disconnect_db()
+                    ok = False
+                
+                if ok:
+                    errors = 0
+                    delay = interval
+                else:
+                    errors += 1
+                    delay = min(interval * 2 ** errors, max_backoff)
+                    print(f"{errors} errors consecutius, propera consulta en {delay:.0f} s")
+                
+                if max_polls is not None and polls >= max_polls:
+                    break
+                time.sleep(delay * random.uniform(1 - jitter, 1 + jitter))
+                
+        except KeyboardInterrupt:
+            print("Mode resident aturat per l'usuari")
+        finally:
+            self.session.close()
+            self.session = None
+            self.disconnect_db()
+        
+        return errors == 0
 
 def main():
     """Funció principal"""
-    downloader = ATMAlertDownloader()
+    parser = argparse.ArgumentParser(description="Descarrega les alertes d'ATM T-mobilitat a la BD")
+    parser.add_argument("--poller", action="store_true",
+                        help="Mode resident: consulta l'API periòdicament amb la mateixa sessió i connexió")
+    parser.add_argument("--interval", type=float, default=60, help="Segons entre consultes (mode resident)")
+    parser.add_argument("--jitter", type=float, default=0.1,
+                        help="Variació aleatòria relativa de l'interval (0.1 = ±10%%)")
+    parser.add_argument("--max-backoff", type=float, default=900,
+                        help="Espera màxima en segons després d'errors consecutius")
+    parser.add_argument("--url", default=None, help="URL alternativa de l'API (p. ex. un servidor de proves)")
+    args = parser.parse_args()
+    
+    # Sense --url es fa servir la URL per defecte del constructor
+    downloader = ATMAlertDownloader(**({'api_url': args.url} if args.url else {}))
     
     # Executar el procés
-    success = downloader.run()
+    if args.poller:
+        success = downloader.run_poller(interval=args.interval, jitter=args.jitter,
+                                        max_backoff=args.max_backoff)
+    else:
+        success = downloader.run()
     
     if not success:
         sys.exit(1)
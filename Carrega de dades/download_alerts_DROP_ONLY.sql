@@ -23,9 +23,17 @@ DROP TRIGGER IF EXISTS update_alerts_modtime ON atm.alerts;
 
 -- Eliminar funcions
 DROP FUNCTION IF EXISTS atm.cleanup_old_alerts(INTEGER);
+DROP FUNCTION IF EXISTS atm.rebuild_alerts_summary();
 DROP FUNCTION IF EXISTS atm.update_modified_column();
 
 -- Eliminar taules (ordre invers per dependencies)
+DROP TABLE IF EXISTS atm.alert_id_summary CASCADE;
+DROP TABLE IF EXISTS atm.alert_daily_summary CASCADE;
+DROP TABLE IF EXISTS atm.alert_download_summary CASCADE;
+DROP TABLE IF EXISTS atm.alerts_active_summary CASCADE;
+DROP TABLE IF EXISTS atm.alert_stop_summary CASCADE;
+DROP TABLE IF EXISTS atm.alert_route_summary CASCADE;
+DROP TABLE IF EXISTS atm.alerts_summary_stats CASCADE;
 DROP TABLE IF EXISTS atm.alert_stops CASCADE;
 DROP TABLE IF EXISTS atm.alert_routes CASCADE;
 DROP TABLE IF EXISTS atm.alerts CASCADE;
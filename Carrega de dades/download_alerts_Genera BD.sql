@@ -20,9 +20,17 @@ DROP TRIGGER IF EXISTS update_alerts_modtime ON atm.alerts;
 
 -- Eliminar funcions
 DROP FUNCTION IF EXISTS atm.cleanup_old_alerts(INTEGER);
+DROP FUNCTION IF EXISTS atm.rebuild_alerts_summary();
 DROP FUNCTION IF EXISTS atm.update_modified_column();
 
 -- Eliminar taules (ordre invers per dependencies)
+DROP TABLE IF EXISTS atm.alert_id_summary CASCADE;
+DROP TABLE IF EXISTS atm.alert_daily_summary CASCADE;
+DROP TABLE IF EXISTS atm.alert_download_summary CASCADE;
+DROP TABLE IF EXISTS atm.alerts_active_summary CASCADE;
+DROP TABLE IF EXISTS atm.alert_stop_summary CASCADE;
+DROP TABLE IF EXISTS atm.alert_route_summary CASCADE;
+DROP TABLE IF EXISTS atm.alerts_summary_stats CASCADE;
 DROP TABLE IF EXISTS atm.alert_stops CASCADE;
 DROP TABLE IF EXISTS atm.alert_routes CASCADE;
 DROP TABLE IF EXISTS atm.alerts CASCADE;
@@ -49,6 +57,8 @@ CREATE TABLE IF NOT EXISTS atm.alerts (
     url_cat TEXT,
     url_es TEXT,
     url_en TEXT,
+    content_hash VARCHAR(64),
+    last_seen TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
@@ -73,6 +83,96 @@ CREATE TABLE IF NOT EXISTS atm.alert_stops (
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- ========================================
+-- Taules de resum
+-- ========================================
+-- Les manté download_alerts.py a la mateixa transacció que cada descàrrega i
+-- a cada actualització de status, de manera que les vistes v_alerts_stats,
+-- v_alerts_active i v_alert_*_by_status no reagreguen tot l'històric.
+-- first_seen/last_seen i first_alert/last_alert no es redueixen quan una alerta
+-- canvia de status o s'esborra; atm.rebuild_alerts_summary() les recalcula.
+
+-- Nombre d'alertes per efecte i status
+CREATE TABLE IF NOT EXISTS atm.alerts_summary_stats (
+    effect VARCHAR(100) NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    total_alerts INTEGER NOT NULL DEFAULT 0,
+    first_seen TIMESTAMP WITH TIME ZONE,
+    last_seen TIMESTAMP WITH TIME ZONE,
+    PRIMARY KEY (effect, status)
+);
+
+-- Nombre d'alertes (no de files d'alert_routes) per ruta i status
+CREATE TABLE IF NOT EXISTS atm.alert_route_summary (
+    route_id VARCHAR(100) NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    total_alerts INTEGER NOT NULL DEFAULT 0,
+    first_alert TIMESTAMP WITH TIME ZONE,
+    last_alert TIMESTAMP WITH TIME ZONE,
+    PRIMARY KEY (route_id, status)
+);
+
+-- Nombre d'alertes (no de files d'alert_stops) per parada i status
+CREATE TABLE IF NOT EXISTS atm.alert_stop_summary (
+    stop_id VARCHAR(100) NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    total_alerts INTEGER NOT NULL DEFAULT 0,
+    first_alert TIMESTAMP WITH TIME ZONE,
+    last_alert TIMESTAMP WITH TIME ZONE,
+    PRIMARY KEY (stop_id, status)
+);
+
+-- Files inserides a cada descàrrega (una per versió nova i període)
+CREATE TABLE IF NOT EXISTS atm.alert_download_summary (
+    download_timestamp TIMESTAMP WITH TIME ZONE PRIMARY KEY,
+    total_alerts INTEGER NOT NULL DEFAULT 0
+);
+
+-- Files inserides per dia i alerta (evolució diària de l'informe)
+CREATE TABLE IF NOT EXISTS atm.alert_daily_summary (
+    dia DATE NOT NULL,
+    alert_id VARCHAR(50) NOT NULL,
+    total_alerts INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (dia, alert_id)
+);
+
+-- Una fila per alert_id (alertes úniques de l'informe)
+CREATE TABLE IF NOT EXISTS atm.alert_id_summary (
+    alert_id VARCHAR(50) PRIMARY KEY,
+    total_alerts INTEGER NOT NULL DEFAULT 0,
+    first_download TIMESTAMP WITH TIME ZONE,
+    last_download TIMESTAMP WITH TIME ZONE
+);
+
+-- Alertes ACTIVE i ACTIVE_OLD, amb les mateixes columnes que v_alerts_complete
+CREATE TABLE IF NOT EXISTS atm.alerts_active_summary (
+    id INTEGER PRIMARY KEY REFERENCES atm.alerts(id) ON DELETE CASCADE,
+    download_timestamp TIMESTAMP WITH TIME ZONE,
+    api_timestamp TIMESTAMP WITH TIME ZONE,
+    gtfs_version VARCHAR(10),
+    incrementality VARCHAR(50),
+    alert_id VARCHAR(50),
+    effect VARCHAR(100),
+    active_start TIMESTAMP WITH TIME ZONE,
+    active_end TIMESTAMP WITH TIME ZONE,
+    status VARCHAR(20),
+    header_cat TEXT,
+    header_es TEXT,
+    header_en TEXT,
+    description_cat TEXT,
+    description_es TEXT,
+    description_en TEXT,
+    url_cat TEXT,
+    url_es TEXT,
+    url_en TEXT,
+    created_at TIMESTAMP WITH TIME ZONE,
+    updated_at TIMESTAMP WITH TIME ZONE,
+    affected_routes TEXT,
+    affected_stops TEXT,
+    content_hash VARCHAR(64),
+    last_seen TIMESTAMP WITH TIME ZONE
+);
+
 -- Índexs per millorar el rendiment
 CREATE INDEX IF NOT EXISTS idx_alerts_alert_id ON atm.alerts(alert_id);
 CREATE INDEX IF NOT EXISTS idx_alerts_download_timestamp ON atm.alerts(download_timestamp);
@@ -80,6 +180,8 @@ CREATE INDEX IF NOT EXISTS idx_alerts_active_start ON atm.alerts(active_start);
 CREATE INDEX IF NOT EXISTS idx_alerts_active_end ON atm.alerts(active_end);
 CREATE INDEX IF NOT EXISTS idx_alerts_effect ON atm.alerts(effect);
 CREATE INDEX IF NOT EXISTS idx_alerts_status ON atm.alerts(status);
+-- Alertes que update_existing_statuses ha de revisar a cada descàrrega
+CREATE INDEX IF NOT EXISTS idx_alerts_not_closed ON atm.alerts(id) WHERE status IS DISTINCT FROM 'CLOSED';
 
 CREATE INDEX IF NOT EXISTS idx_alert_routes_alert_id ON atm.alert_routes(alert_id);
 CREATE INDEX IF NOT EXISTS idx_alert_routes_route_id ON atm.alert_routes(route_id);
@@ -91,9 +193,20 @@ CREATE INDEX IF NOT EXISTS idx_alert_stops_stop_id ON atm.alert_stops(stop_id);
 CREATE INDEX IF NOT EXISTS idx_alert_stops_alert_table_id ON atm.alert_stops(alert_table_id);
 CREATE INDEX IF NOT EXISTS idx_alert_stops_status ON atm.alert_stops(status);
 
--- Constraint per evitar duplicats en la mateixa descàrrega
-CREATE UNIQUE INDEX IF NOT EXISTS idx_alerts_unique_download 
+-- Una versió per canvi de cada alerta: una descàrrega només insereix les alertes
+-- noves o amb hashos (content_hash) diferents dels de la seva darrera versió, és a
+-- dir, les files de l'alert_id amb el download_timestamp més recent. Una alerta
+-- amb diversos períodes actius té una fila per període i cada versió les inclou
+-- totes. Les que no han canviat només actualitzen last_seen.
+CREATE INDEX IF NOT EXISTS idx_alerts_version 
 ON atm.alerts(alert_id, download_timestamp);
+-- Per actualitzar una BD existent (les files antigues queden amb content_hash NULL):
+-- ALTER TABLE atm.alerts ADD COLUMN content_hash VARCHAR(64), ADD COLUMN last_seen TIMESTAMP WITH TIME ZONE DEFAULT NOW();
+-- UPDATE atm.alerts SET last_seen = download_timestamp;
+-- DROP INDEX IF EXISTS atm.idx_alerts_unique_download;
+-- DROP INDEX IF EXISTS atm.idx_alerts_unique_content;
+-- CREATE INDEX idx_alerts_version ON atm.alerts(alert_id, download_timestamp);
+-- Després de crear les taules de resum en una BD existent: SELECT atm.rebuild_alerts_summary();
 
 -- Función para actualizar el timestamp de modificación
 CREATE OR REPLACE FUNCTION atm.update_modified_column()
@@ -136,7 +249,9 @@ SELECT
     a.created_at,
     a.updated_at,
     string_agg(DISTINCT ar.route_id, ';' ORDER BY ar.route_id) AS affected_routes,
-    string_agg(DISTINCT ast.stop_id, ';' ORDER BY ast.stop_id) AS affected_stops
+    string_agg(DISTINCT ast.stop_id, ';' ORDER BY ast.stop_id) AS affected_stops,
+    a.content_hash,
+    a.last_seen
 FROM atm.alerts a
 LEFT JOIN atm.alert_routes ar ON a.id = ar.alert_table_id
 LEFT JOIN atm.alert_stops ast ON a.id = ast.alert_table_id
@@ -145,23 +260,22 @@ GROUP BY
     a.incrementality, a.alert_id, a.effect, a.active_start, a.active_end, a.status,
     a.header_cat, a.header_es, a.header_en, a.description_cat, 
     a.description_es, a.description_en, a.url_cat, a.url_es, a.url_en,
-    a.created_at, a.updated_at;
+    a.created_at, a.updated_at, a.content_hash, a.last_seen;
 
 -- Vista per alertes actives (sense data de finalització o futura)
 CREATE OR REPLACE VIEW atm.v_alerts_active AS
-SELECT * FROM atm.v_alerts_complete
-WHERE status IN ('ACTIVE', 'ACTIVE_OLD');
+SELECT * FROM atm.alerts_active_summary;
 
 -- Vista per estadístiques d'alertes
 CREATE OR REPLACE VIEW atm.v_alerts_stats AS
 SELECT 
     effect,
     status,
-    COUNT(*) as total_alerts,
-    MIN(download_timestamp) as first_seen,
-    MAX(download_timestamp) as last_seen
-FROM atm.alerts
-GROUP BY effect, status
+    total_alerts,
+    first_seen,
+    last_seen
+FROM atm.alerts_summary_stats
+WHERE total_alerts > 0
 ORDER BY effect, status;
 
 -- Vista per alertes per status específic
@@ -186,28 +300,82 @@ ORDER BY
 -- Vista per alertes de routes per status
 CREATE OR REPLACE VIEW atm.v_alert_routes_by_status AS
 SELECT 
-    ar.route_id,
-    ar.status,
-    COUNT(*) as total_alerts,
-    MIN(a.active_start) as first_alert,
-    MAX(a.active_start) as last_alert
-FROM atm.alert_routes ar
-JOIN atm.alerts a ON ar.alert_table_id = a.id
-GROUP BY ar.route_id, ar.status
-ORDER BY ar.route_id, ar.status;
+    route_id,
+    status,
+    total_alerts,
+    first_alert,
+    last_alert
+FROM atm.alert_route_summary
+WHERE total_alerts > 0
+ORDER BY route_id, status;
 
 -- Vista per alertes de stops per status  
 CREATE OR REPLACE VIEW atm.v_alert_stops_by_status AS
 SELECT 
-    ast.stop_id,
-    ast.status,
-    COUNT(*) as total_alerts,
-    MIN(a.active_start) as first_alert,
-    MAX(a.active_start) as last_alert
-FROM atm.alert_stops ast
-JOIN atm.alerts a ON ast.alert_table_id = a.id
-GROUP BY ast.stop_id, ast.status
-ORDER BY ast.stop_id, ast.status;
+    stop_id,
+    status,
+    total_alerts,
+    first_alert,
+    last_alert
+FROM atm.alert_stop_summary
+WHERE total_alerts > 0
+ORDER BY stop_id, status;
+
+-- Recalcula totes les taules de resum a partir d'alerts, alert_routes i alert_stops
+-- (per omplir-les en una BD existent o després d'esborrar alertes)
+CREATE OR REPLACE FUNCTION atm.rebuild_alerts_summary()
+RETURNS VOID AS $$
+BEGIN
+    TRUNCATE atm.alerts_summary_stats, atm.alert_route_summary,
+             atm.alert_stop_summary, atm.alerts_active_summary,
+             atm.alert_download_summary, atm.alert_daily_summary, atm.alert_id_summary;
+    
+    INSERT INTO atm.alerts_summary_stats (effect, status, total_alerts, first_seen, last_seen)
+    SELECT COALESCE(effect, ''), COALESCE(status, ''), COUNT(*),
+           MIN(download_timestamp), MAX(COALESCE(last_seen, download_timestamp))
+    FROM atm.alerts
+    GROUP BY 1, 2;
+    
+    INSERT INTO atm.alert_route_summary (route_id, status, total_alerts, first_alert, last_alert)
+    SELECT r.route_id, COALESCE(a.status, ''), COUNT(*), MIN(a.active_start), MAX(a.active_start)
+    FROM (SELECT DISTINCT alert_table_id, route_id FROM atm.alert_routes) r
+    JOIN atm.alerts a ON a.id = r.alert_table_id
+    GROUP BY 1, 2;
+    
+    INSERT INTO atm.alert_stop_summary (stop_id, status, total_alerts, first_alert, last_alert)
+    SELECT s.stop_id, COALESCE(a.status, ''), COUNT(*), MIN(a.active_start), MAX(a.active_start)
+    FROM (SELECT DISTINCT alert_table_id, stop_id FROM atm.alert_stops) s
+    JOIN atm.alerts a ON a.id = s.alert_table_id
+    GROUP BY 1, 2;
+    
+    INSERT INTO atm.alerts_active_summary
+        (id, download_timestamp, api_timestamp, gtfs_version, incrementality, alert_id,
+         effect, active_start, active_end, status, header_cat, header_es, header_en,
+         description_cat, description_es, description_en, url_cat, url_es, url_en,
+         created_at, updated_at, affected_routes, affected_stops, content_hash, last_seen)
+    SELECT id, download_timestamp, api_timestamp, gtfs_version, incrementality, alert_id,
+           effect, active_start, active_end, status, header_cat, header_es, header_en,
+           description_cat, description_es, description_en, url_cat, url_es, url_en,
+           created_at, updated_at, affected_routes, affected_stops, content_hash, last_seen
+    FROM atm.v_alerts_complete
+    WHERE status IN ('ACTIVE', 'ACTIVE_OLD');
+    
+    INSERT INTO atm.alert_download_summary (download_timestamp, total_alerts)
+    SELECT download_timestamp, COUNT(*)
+    FROM atm.alerts
+    GROUP BY 1;
+    
+    INSERT INTO atm.alert_daily_summary (dia, alert_id, total_alerts)
+    SELECT DATE(download_timestamp), alert_id, COUNT(*)
+    FROM atm.alerts
+    GROUP BY 1, 2;
+    
+    INSERT INTO atm.alert_id_summary (alert_id, total_alerts, first_download, last_download)
+    SELECT alert_id, COUNT(*), MIN(download_timestamp), MAX(download_timestamp)
+    FROM atm.alerts
+    GROUP BY 1;
+END;
+$$ LANGUAGE plpgsql;
 
 -- Procedure per netejar alertes antigues segons status
 CREATE OR REPLACE FUNCTION atm.cleanup_old_alerts(days_to_keep INTEGER DEFAULT 30)
@@ -217,22 +385,26 @@ DECLARE
     old_deleted INTEGER;
     total_deleted INTEGER;
 BEGIN
-    -- Eliminar alertes CLOSED més antigues que days_to_keep
+    -- Eliminar alertes CLOSED que no s'han vist en els darrers days_to_keep dies
     DELETE FROM atm.alerts 
     WHERE status = 'CLOSED' 
-    AND download_timestamp < NOW() - (days_to_keep || ' days')::INTERVAL;
+    AND COALESCE(last_seen, download_timestamp) < NOW() - (days_to_keep || ' days')::INTERVAL;
     
     GET DIAGNOSTICS closed_deleted = ROW_COUNT;
     
     -- Eliminar alertes ACTIVE_OLD molt antigues (més del doble de dies)
     DELETE FROM atm.alerts 
     WHERE status = 'ACTIVE_OLD' 
-    AND download_timestamp < NOW() - ((days_to_keep * 2) || ' days')::INTERVAL;
+    AND COALESCE(last_seen, download_timestamp) < NOW() - ((days_to_keep * 2) || ' days')::INTERVAL;
     
     GET DIAGNOSTICS old_deleted = ROW_COUNT;
     
     total_deleted := closed_deleted + old_deleted;
     
+    IF total_deleted > 0 THEN
+        PERFORM atm.rebuild_alerts_summary();
+    END IF;
+    
     RETURN QUERY SELECT 
         total_deleted,
         format('CLOSED: %s, ACTIVE_OLD: %s, Total: %s', 
@@ -245,10 +417,20 @@ COMMENT ON TABLE atm.alerts IS 'Taula principal que emmagatzema les alertes de T
 COMMENT ON TABLE atm.alert_routes IS 'Taula que relaciona alertes amb les rutes afectades';
 COMMENT ON TABLE atm.alert_stops IS 'Taula que relaciona alertes amb les parades afectades';
 
+COMMENT ON COLUMN atm.alerts.content_hash IS 'Hash SHA-256 del contingut (efecte, període actiu, textos i entitats informades)';
+COMMENT ON COLUMN atm.alerts.last_seen IS 'Darrera descàrrega en què s''ha vist l''alerta sense canvis (s''actualitza com a molt cada 15 minuts)';
 COMMENT ON COLUMN atm.alerts.status IS 'Status de l''alerta: ACTIVE, ACTIVE_OLD, CLOSED (gestionat per l''aplicació)';
 COMMENT ON COLUMN atm.alert_routes.status IS 'Status de l''alerta per la ruta (gestionat per l''aplicació)';
 COMMENT ON COLUMN atm.alert_stops.status IS 'Status de l''alerta per la parada (gestionat per l''aplicació)';
 
+COMMENT ON TABLE atm.alerts_summary_stats IS 'Resum d''alertes per efecte i status (mantingut per download_alerts.py)';
+COMMENT ON TABLE atm.alert_route_summary IS 'Resum d''alertes per ruta i status (mantingut per download_alerts.py)';
+COMMENT ON TABLE atm.alert_stop_summary IS 'Resum d''alertes per parada i status (mantingut per download_alerts.py)';
+COMMENT ON TABLE atm.alert_download_summary IS 'Files d''alertes inserides per descàrrega (mantingut per download_alerts.py)';
+COMMENT ON TABLE atm.alert_daily_summary IS 'Files d''alertes inserides per dia i alert_id (mantingut per download_alerts.py)';
+COMMENT ON TABLE atm.alert_id_summary IS 'Una fila per alert_id amb el nombre de files i la primera i darrera descàrrega (mantingut per download_alerts.py)';
+COMMENT ON TABLE atm.alerts_active_summary IS 'Alertes ACTIVE i ACTIVE_OLD amb rutes i parades agregades (mantingut per download_alerts.py)';
+
 COMMENT ON VIEW atm.v_alerts_complete IS 'Vista completa d''alertes amb rutes i parades agregades';
 COMMENT ON VIEW atm.v_alerts_active IS 'Vista d''alertes amb status ACTIVE o ACTIVE_OLD';
 COMMENT ON VIEW atm.v_alerts_stats IS 'Vista amb estadístiques d''alertes per efecte i status';
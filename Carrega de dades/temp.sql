@@ -1,13 +1,21 @@
+-- Fa servir les llistes de serveis de sto_puntuades, que AvaluaServeisDisponibles.py
+-- desa per defecte (no les desa amb --sense-llistes): si hi falten, el bloc següent falla.
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM sto_puntuades
+               WHERE lst_serv_arribada_dia IS NULL AND coalesce(num_serv_arribada_dia, 0) > 0) THEN
+        RAISE EXCEPTION 'sto_puntuades no té les llistes de serveis: cal tornar a puntuar les parades sense --sense-llistes';
+    END IF;
+END $$;
 -----------------------------------------------------------------------
 WITH reg_ids AS (
     SELECT 
         sp.id AS taula_a_id,
-        sp.lst_serv_arribada ,
-        trim(unnest(string_to_array(sp.lst_serv_arribada, ',')))::INTEGER AS id,
+        sp.lst_serv_arribada_dia,
+        unnest(sp.lst_serv_arribada_dia) AS id,
         sp.stop_id
     FROM sto_puntuades sp
-    WHERE sp.lst_serv_arribada IS NOT NULL 
-      AND sp.lst_serv_arribada != ''
+    WHERE sp.lst_serv_arribada_dia IS NOT NULL
       --and sp.stop_id='COS_19100'
 ),
 tr as (SELECT sp.route_id,
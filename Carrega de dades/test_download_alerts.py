@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Proves del mode resident de download_alerts.py contra un servidor HTTP local
+(http.server) que serveix un feed de proves amb ETag.
+
+No cal la BD: les proves de poll_once substitueixen els mètodes que hi
+accedeixen. Execució: python -m unittest test_download_alerts
+"""
+
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import requests
+
+from download_alerts import ATMAlertDownloader
+
+
+def make_feed(timestamp):
+    """Feed JSON mínim amb una alerta i el timestamp de capçalera indicat"""
+    return json.dumps({
+        'header': {'gtfs_realtime_version': '2.0', 'incrementality': 'FULL_DATASET',
+                   'timestamp': timestamp},
+        'entity': [{
+            'id': 'A1',
+            'alert': {
+                'effect': 'DETOUR',
+                'active_period': [{'start': timestamp}],
+                'informed_entity': [{'route_id': 'R1'}, {'stop_id': 'S1'}],
+                'header_text': {'translation': [{'language': 'ca', 'text': 'Desviament'}]},
+            }
+        }]
+    }).encode('utf-8')
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    """Serveix server.feed; respon 304 si If-None-Match coincideix amb server.etag"""
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        if server.etag and self.headers.get('If-None-Match') == server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(server.feed)))
+        if server.etag:
+            self.send_header('ETag', server.etag)
+        self.end_headers()
+        self.wfile.write(server.feed)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PollerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FeedHandler)
+        self.server.feed = make_feed(1760000000)
+        self.server.etag = None
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+        url = f"http://127.0.0.1:{self.server.server_address[1]}/alerts"
+        self.downloader = ATMAlertDownloader(api_url=url)
+        self.downloader.session = requests.Session()
+
+    def tearDown(self):
+        self.downloader.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def test_etag_304(self):
+        self.server.etag = '"v1"'
+
+        content, changed = self.downloader.download_if_changed()
+        self.assertEqual(content, self.server.feed)
+        self.assertTrue(changed)
+        self.assertEqual(self.downloader.etag, '"v1"')
+        self.assertNotIn('If-None-Match', self.server.requests[0])
+
+        content, changed = self.downloader.download_if_changed()
+        self.assertEqual(content, b'')
+        self.assertFalse(changed)
+        self.assertEqual(self.server.requests[1].get('If-None-Match'), '"v1"')
+
+        # Amb una ETag nova el servidor torna a enviar el feed
+        self.server.etag = '"v2"'
+        self.server.feed = make_feed(1760000060)
+        content, changed = self.downloader.download_if_changed()
+        self.assertEqual(content, self.server.feed)
+        self.assertTrue(changed)
+        self.assertEqual(self.downloader.etag, '"v2"')
+
+    def test_same_feed_content(self):
+        # Sense ETag el servidor sempre respon 200: es compara el hash del contingut
+        with mock.patch.object(self.downloader, 'iter_feed') as iter_feed:
+            content, changed = self.downloader.download_if_changed()
+            self.assertTrue(changed)
+
+            content, changed = self.downloader.download_if_changed()
+            self.assertEqual(content, self.server.feed)
+            self.assertFalse(changed)
+
+            self.server.feed = make_feed(1760000060)
+            content, changed = self.downloader.download_if_changed()
+            self.assertTrue(changed)
+
+            # La comparació no llegeix el feed
+            iter_feed.assert_not_called()
+
+    def test_poll_once_skips_unchanged_feed(self):
+        self.server.etag = '"v1"'
+        self.downloader.conn = mock.Mock(closed=False)
+
+        with mock.patch.object(self.downloader, 'update_existing_statuses', return_value=True), \
+             mock.patch.object(self.downloader, 'save_to_database', return_value=True) as save:
+            self.assertTrue(self.downloader.poll_once())
+            self.assertEqual(save.call_count, 1)
+
+            # 304: no es processa ni es guarda res
+            self.assertTrue(self.downloader.poll_once())
+            self.assertEqual(save.call_count, 1)
+
+            # 200 amb el mateix contingut: tampoc
+            self.server.etag = '"v2"'
+            self.assertTrue(self.downloader.poll_once())
+            self.assertEqual(save.call_count, 1)
+
+    def test_poll_once_retries_unreadable_feed(self):
+        self.server.etag = '"v1"'
+        self.server.feed = make_feed(1760000000)[:40]
+        self.downloader.conn = mock.Mock(closed=False)
+
+        with mock.patch.object(self.downloader, 'update_existing_statuses', return_value=True), \
+             mock.patch.object(self.downloader, 'save_to_database', return_value=True) as save:
+            # Feed truncat: error i validadors oblidats
+            self.assertFalse(self.downloader.poll_once())
+            self.assertEqual(save.call_count, 0)
+            self.assertIsNone(self.downloader.etag)
+            self.assertIsNone(self.downloader.last_feed_hash)
+
+            # La consulta següent no envia If-None-Match i torna a processar el feed
+            self.server.feed = make_feed(1760000000)
+            self.assertTrue(self.downloader.poll_once())
+            self.assertNotIn('If-None-Match', self.server.requests[-1])
+            self.assertEqual(save.call_count, 1)
+
+    def test_server_error(self):
+        self.server.shutdown()
+        self.server.server_close()
+        content, changed = self.downloader.download_if_changed()
+        self.assertIsNone(content)
+        self.assertFalse(changed)
+
+
+if __name__ == '__main__':
+    unittest.main()